@@ -1,15 +1,14 @@
 from fastapi import APIRouter, HTTPException
 import databutton as db
-import requests
 import re
 import json
-import base64
 import random
 import time
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional, Any, Union
+from app.libs.dataforseo_client import KEYWORDS_FOR_KEYWORDS_PATH, close_dataforseo_client, dataforseo_post
 
-router = APIRouter()
+router = APIRouter(on_shutdown=[close_dataforseo_client])
 
 class KeywordAnalysisRequest(BaseModel):
     seed_keyword: str
@@ -56,7 +55,7 @@ def get_dataforseo_credentials():
     return username, password
 
 # Function to get keywords data using the DataForSEO API
-def get_keywords_data(seed_keyword: str, limit: int = 50) -> tuple[list, bool]:
+async def get_keywords_data(seed_keyword: str, limit: int = 50) -> tuple[list, bool]:
     """Get keyword data using DataForSEO API
     
     Args:
@@ -66,23 +65,11 @@ def get_keywords_data(seed_keyword: str, limit: int = 50) -> tuple[list, bool]:
     Returns:
         tuple: (keywords_data, is_sample_data)
     """
-    username, password = get_dataforseo_credentials()
+    # Fail with a 500 before the fallback if credentials are missing
+    get_dataforseo_credentials()
     
     try:
-        # Create the authorization string
-        print(f"Using requests for DataForSEO API: {seed_keyword}")
-        # Create the authorization string
-        auth_string = f"{username}:{password}"
-        base64_auth = base64.b64encode(auth_string.encode()).decode()
-        
-        # Set up the request headers
-        headers = {
-            'Authorization': f'Basic {base64_auth}',
-            'Content-Type': 'application/json'
-        }
-        
-        # DataForSEO API endpoint for keyword suggestions
-        url = "https://api.dataforseo.com/v3/keywords_data/google_ads/keywords_for_keywords/live"
+        print(f"Using shared DataForSEO client: {seed_keyword}")
         
         # Prepare the payload
         payload = [
@@ -95,9 +82,9 @@ def get_keywords_data(seed_keyword: str, limit: int = 50) -> tuple[list, bool]:
             }
         ]
         
-        # Make the API request with increased timeout
-        print(f"Making request to {url} with timeout 60s")
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
+        # Make the API request through the pooled client
+        print(f"Making request to {KEYWORDS_FOR_KEYWORDS_PATH}")
+        response = await dataforseo_post(KEYWORDS_FOR_KEYWORDS_PATH, payload)
         response.raise_for_status()
         result = response.json()
         
@@ -117,7 +104,7 @@ def get_keywords_data(seed_keyword: str, limit: int = 50) -> tuple[list, bool]:
             print(f"No keywords found from DataForSEO API, falling back to sample data")
             return generate_sample_data(seed_keyword, limit), True
             
-        print(f"Got {len(keywords_data)} keywords from DataForSEO API via requests")
+        print(f"Got {len(keywords_data)} keywords from DataForSEO API")
         return keywords_data, False
             
     except Exception as e:
@@ -127,7 +114,7 @@ def get_keywords_data(seed_keyword: str, limit: int = 50) -> tuple[list, bool]:
         return sample_data, True
 
 @router.post("/analyze-metrics", operation_id="analyze_keyword_metrics")
-def analyze_keywords_metrics(request: KeywordAnalysisRequest) -> KeywordAnalysisResponse:
+async def analyze_keywords_metrics(request: KeywordAnalysisRequest) -> KeywordAnalysisResponse:
     """Analyze keywords to find tool keywords and monetization keywords
     
     This endpoint uses the DataForSEO API to find keywords related to the seed keyword,
@@ -148,7 +135,7 @@ def analyze_keywords_metrics(request: KeywordAnalysisRequest) -> KeywordAnalysis
     
     try:
         # Get keywords data using the DataForSEO API or sample data
-        keywords_data, is_sample_data = get_keywords_data(seed_keyword, max(50, request.limit * 5))
+        keywords_data, is_sample_data = await get_keywords_data(seed_keyword, max(50, request.limit * 5))
         
         # Log results
         if is_sample_data:
@@ -264,7 +251,7 @@ def generate_sample_data(seed_keyword: str, count: int):
 
 # Add a second API endpoint with a different name to avoid duplicate operation ID
 @router.post("/analyze-alternative", operation_id="analyze_keywords_alternative")
-def analyze_keywords_alt(request: KeywordAnalysisRequest) -> KeywordAnalysisResponse:
+async def analyze_keywords_alt(request: KeywordAnalysisRequest) -> KeywordAnalysisResponse:
     """Alternative endpoint for keyword analysis with the same functionality
     
     This is a backup endpoint that calls the main implementation, useful for testing
@@ -277,7 +264,7 @@ def analyze_keywords_alt(request: KeywordAnalysisRequest) -> KeywordAnalysisResp
         KeywordAnalysisResponse with tool_keywords and monetization_keywords
     """
     # This is a backup endpoint that calls the main implementation
-    return analyze_keywords_metrics(request)
+    return await analyze_keywords_metrics(request)
 
 # Generate relevant tags based on keywords
 def generate_tags(seed_keyword: str, tool_keywords: List[KeywordMetrics], monetization_keywords: List[KeywordMetrics]):
@@ -4,8 +4,12 @@ from fastapi import APIRouter, HTTPException, Request, Depends, Header
 import stripe
 import databutton as db
 import json
+import asyncio
 from datetime import datetime, timedelta
 from app.auth import AuthorizedUser
+from app.libs.stripe_client import call_stripe
+from app.libs.stripe_customer_index import stripe_customer_index
+from app.libs.subscription_status_cache import subscription_record, subscription_status_cache
 
 # Initialize router
 router = APIRouter()
@@ -129,6 +133,56 @@ def get_plan_by_id(plan_id: str) -> Optional[SubscriptionPlan]:
             return plan
     return None
 
+# Helper function to find a user's Stripe customer by email, preferring one already linked to the user.
+# Customers whose metadata names another user are never returned: emails aren't verified ownership.
+async def find_customer_by_email(user: AuthorizedUser) -> Optional[stripe.Customer]:
+    if not user.email:
+        return None
+    customers = await call_stripe(stripe.Customer.list, email=user.email)
+    if not customers or not customers.data:
+        return None
+    for customer in customers.data:
+        if customer.metadata and customer.metadata.get('user_id') == user.sub:
+            return customer
+    for customer in customers.data:
+        if not (customer.metadata or {}).get('user_id'):
+            return customer
+    return None
+
+# Helper function to get the user's Stripe customer ID from the customer index
+async def get_customer_id(user: AuthorizedUser) -> Optional[str]:
+    customer_id = await asyncio.to_thread(stripe_customer_index.customer_for_user, user.sub)
+    if customer_id:
+        return customer_id
+    
+    # Customers created before the index existed are looked up once and linked
+    customer = await find_customer_by_email(user)
+    if not customer:
+        return None
+    await asyncio.to_thread(stripe_customer_index.put, customer.id, user.sub, customer.email)
+    return customer.id
+
+# Helper function to get the customer that owns a subscription, from the customer index when possible
+async def get_subscription_customer_id(subscription_id: str) -> str:
+    customer_id = await asyncio.to_thread(stripe_customer_index.subscription_customer, subscription_id)
+    if customer_id:
+        return customer_id
+    
+    subscription = await call_stripe(stripe.Subscription.retrieve, subscription_id)
+    await asyncio.to_thread(stripe_customer_index.put_subscription, subscription.id, subscription.customer)
+    return subscription.customer
+
+# Helper function to verify that a subscription belongs to the user
+async def verify_subscription_owner(subscription_id: str, user: AuthorizedUser) -> None:
+    # The two lookups are independent, and usually both local
+    customer_id, owner_id = await asyncio.gather(
+        get_customer_id(user),
+        get_subscription_customer_id(subscription_id)
+    )
+    
+    if not customer_id or customer_id != owner_id:
+        raise HTTPException(status_code=403, detail="Subscription does not belong to this user")
+
 # Endpoint to get available subscription plans
 @router.get("/plans")
 async def get_subscription_plans() -> List[SubscriptionPlan]:
@@ -150,25 +204,32 @@ async def create_checkout_session(
     
     try:
         # Create a customer if they don't exist
-        customers = stripe.Customer.list(email=user.email)
-        if customers and customers.data:
-            customer = customers.data[0]
-            
-            # Update customer metadata with user ID if needed
-            if 'user_id' not in customer.metadata or customer.metadata['user_id'] != user.sub:
-                stripe.Customer.modify(
-                    customer.id,
+        customer_id = await asyncio.to_thread(stripe_customer_index.customer_for_user, user.sub)
+        if not customer_id:
+            customer = await find_customer_by_email(user)
+            if customer:
+                # Claim an unlinked customer for this user
+                if not (customer.metadata or {}).get('user_id'):
+                    await call_stripe(
+                        stripe.Customer.modify,
+                        customer.id,
+                        metadata={"user_id": user.sub}
+                    )
+            else:
+                customer = await call_stripe(
+                    stripe.Customer.create,
+                    email=user.email,
                     metadata={"user_id": user.sub}
                 )
-        else:
-            customer = stripe.Customer.create(
-                email=user.email,
-                metadata={"user_id": user.sub}
-            )
+            
+            # Link the user to the customer so later requests skip the lookup
+            customer_id = customer.id
+            await asyncio.to_thread(stripe_customer_index.put, customer_id, user.sub, customer.email or user.email)
         
         # Create checkout session
-        checkout_session = stripe.checkout.Session.create(
-            customer=customer.id,
+        checkout_session = await call_stripe(
+            stripe.checkout.Session.create,
+            customer=customer_id,
             payment_method_types=['card'],
             line_items=[{
                 'price': plan.stripe_price_id,
@@ -198,101 +259,102 @@ async def create_checkout_session(
     except stripe.error.StripeError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# Status returned to users without an active subscription
+def free_plan_status() -> SubscriptionStatus:
+    return SubscriptionStatus(
+        is_active=True,  # Everyone has access to free features
+        is_trial=False,
+        subscription=None,
+        available_plans=SUBSCRIPTION_PLANS
+    )
+
+# Helper function to build the status response from a cached subscription record
+def status_from_record(record: Optional[Dict[str, Any]]) -> SubscriptionStatus:
+    if not record:
+        return free_plan_status()
+    
+    # Determine the plan ID from metadata or infer from price
+    plan_id = record.get('plan_id')
+    
+    if not plan_id:
+        # Try to infer plan from price
+        for plan in SUBSCRIPTION_PLANS:
+            if plan.stripe_price_id and plan.stripe_price_id == record.get('price_id'):
+                plan_id = plan.id
+                break
+        
+        # If still not found, default to premium
+        if not plan_id:
+            plan_id = PLAN_PREMIUM
+    
+    # Determine trial status
+    is_trial = record['status'] == 'trialing'
+    trial_end = datetime.fromtimestamp(record['trial_end']) if record.get('trial_end') else None
+    
+    # Build subscription info
+    current_sub = CurrentSubscription(
+        plan_id=plan_id,
+        status=record['status'],
+        current_period_end=datetime.fromtimestamp(record['current_period_end']),
+        cancel_at_period_end=record['cancel_at_period_end'],
+        trial_end=trial_end,
+        subscription_id=record['subscription_id'],
+        payment_method=record.get('payment_method')
+    )
+    
+    return SubscriptionStatus(
+        is_active=True,  # Premium plan is active
+        is_trial=is_trial,
+        subscription=current_sub,
+        available_plans=SUBSCRIPTION_PLANS
+    )
+
+# Helper function to look up the subscription record for a user in Stripe
+async def fetch_subscription_record(user: AuthorizedUser) -> Optional[Dict[str, Any]]:
+    # Look up customer
+    customer_id = await get_customer_id(user)
+    if not customer_id:
+        # No customer found, free plan
+        return None
+    
+    # Get subscriptions
+    subscriptions = await call_stripe(
+        stripe.Subscription.list,
+        customer=customer_id,
+        status="active",
+        expand=["data.default_payment_method"]
+    )
+    
+    if not subscriptions or not subscriptions.data:
+        # No active subscription, free plan
+        return None
+    
+    # Get the latest subscription
+    subscription = subscriptions.data[0]
+    await asyncio.to_thread(stripe_customer_index.put_subscription, subscription.id, customer_id)
+    return subscription_record(subscription)
+
 # Endpoint to get current subscription status
 @router.get("/status")
 async def get_subscription_status(user: AuthorizedUser) -> SubscriptionStatus:
-    """Get the current subscription status for a user."""
+    """
+    Get the current subscription status for a user. Served from the status cache, which the
+    webhook handlers keep current; Stripe is only queried when the entry is missing or expired.
+    """
     
-    try:
-        # Look up customer
-        customers = stripe.Customer.list(email=user.email)
-        if not customers or not customers.data:
-            # No customer found, return free plan status
-            return SubscriptionStatus(
-                is_active=True,  # Everyone has access to free features
-                is_trial=False,
-                subscription=None,
-                available_plans=SUBSCRIPTION_PLANS
-            )
-        
-        customer = customers.data[0]
-        
-        # Get subscriptions
-        subscriptions = stripe.Subscription.list(
-            customer=customer.id,
-            status="active",
-            expand=["data.default_payment_method"]
-        )
-        
-        if not subscriptions or not subscriptions.data:
-            # No active subscription, return free plan status
-            return SubscriptionStatus(
-                is_active=True,  # Everyone has access to free features
-                is_trial=False,
-                subscription=None,
-                available_plans=SUBSCRIPTION_PLANS
-            )
-        
-        # Get the latest subscription
-        subscription = subscriptions.data[0]
-        
-        # Determine the plan ID from metadata or infer from price
-        plan_id = subscription.metadata.get('plan_id') if subscription.metadata else None
-        
-        if not plan_id:
-            # Try to infer plan from price
-            for plan in SUBSCRIPTION_PLANS:
-                if plan.stripe_price_id and plan.stripe_price_id == subscription.items.data[0].price.id:
-                    plan_id = plan.id
-                    break
-            
-            # If still not found, default to premium
-            if not plan_id:
-                plan_id = PLAN_PREMIUM
-        
-        # Determine trial status
-        is_trial = subscription.status == 'trialing'
-        trial_end = datetime.fromtimestamp(subscription.trial_end) if subscription.trial_end else None
-        
-        # Extract payment method info if available
-        payment_method = None
-        if subscription.default_payment_method:
-            pm = subscription.default_payment_method
-            payment_method = {
-                "brand": pm.card.brand,
-                "last4": pm.card.last4,
-                "exp_month": pm.card.exp_month,
-                "exp_year": pm.card.exp_year,
-                "id": pm.id
-            }
-        
-        # Build subscription info
-        current_sub = CurrentSubscription(
-            plan_id=plan_id,
-            status=subscription.status,
-            current_period_end=datetime.fromtimestamp(subscription.current_period_end),
-            cancel_at_period_end=subscription.cancel_at_period_end,
-            trial_end=trial_end,
-            subscription_id=subscription.id,
-            payment_method=payment_method
-        )
-        
-        return SubscriptionStatus(
-            is_active=True,  # Premium plan is active
-            is_trial=is_trial,
-            subscription=current_sub,
-            available_plans=SUBSCRIPTION_PLANS
-        )
+    entry = await asyncio.to_thread(subscription_status_cache.get, user.sub)
+    if entry is not None:
+        return status_from_record(entry['subscription'])
     
+    try:
+        record = await fetch_subscription_record(user)
     except stripe.error.StripeError as e:
         # On error, still return a valid status but log the error
         print(f"Error getting subscription status: {str(e)}")
-        return SubscriptionStatus(
-            is_active=True,  # Default to free access on error
-            is_trial=False,
-            subscription=None,
-            available_plans=SUBSCRIPTION_PLANS
-        )
+        return free_plan_status()  # Default to free access on error
+    
+    await asyncio.to_thread(subscription_status_cache.put, user.sub, record)
+    return status_from_record(record)
 
 # Endpoint to cancel subscription
 @router.post("/cancel")
@@ -305,25 +367,25 @@ async def cancel_subscription(
     
     try:
         # Verify the subscription belongs to this user
-        subscription = stripe.Subscription.retrieve(subscription_id)
-        customers = stripe.Customer.list(email=user.email)
-        
-        if not customers or not customers.data or customers.data[0].id != subscription.customer:
-            raise HTTPException(status_code=403, detail="Subscription does not belong to this user")
+        await verify_subscription_owner(subscription_id, user)
         
         # Cancel the subscription
         if at_period_end:
             # Cancel at period end
-            updated_subscription = stripe.Subscription.modify(
+            updated_subscription = await call_stripe(
+                stripe.Subscription.modify,
                 subscription_id,
                 cancel_at_period_end=True
             )
             message = "Subscription will be canceled at the end of the current billing period"
         else:
             # Cancel immediately
-            updated_subscription = stripe.Subscription.delete(subscription_id)
+            updated_subscription = await call_stripe(stripe.Subscription.delete, subscription_id)
             message = "Subscription has been canceled immediately"
         
+        # Reflect the change in /status without waiting for the webhook
+        await asyncio.to_thread(subscription_status_cache.update_from_subscription, user.sub, updated_subscription)
+        
         return {
             "success": True,
             "message": message,
@@ -343,23 +405,30 @@ async def reactivate_subscription(
     """Reactivate a subscription that was set to cancel at period end."""
     
     try:
-        # Verify the subscription belongs to this user
-        subscription = stripe.Subscription.retrieve(subscription_id)
-        customers = stripe.Customer.list(email=user.email)
-        
-        if not customers or not customers.data or customers.data[0].id != subscription.customer:
-            raise HTTPException(status_code=403, detail="Subscription does not belong to this user")
+        # Verify the subscription belongs to this user, reading its cached status meanwhile
+        _, entry = await asyncio.gather(
+            verify_subscription_owner(subscription_id, user),
+            asyncio.to_thread(subscription_status_cache.get, user.sub)
+        )
         
-        # Can only reactivate if it's set to cancel at period end
-        if not subscription.cancel_at_period_end:
-            raise HTTPException(status_code=400, detail="Subscription is not set to cancel at period end")
+        # Can only reactivate if it's set to cancel at period end. A cached "set to cancel" is
+        # acted on directly, since reactivating twice is harmless; anything else is checked in Stripe
+        cached = (entry or {}).get('subscription') or {}
+        if cached.get('subscription_id') != subscription_id or not cached.get('cancel_at_period_end'):
+            subscription = await call_stripe(stripe.Subscription.retrieve, subscription_id)
+            if not subscription.cancel_at_period_end:
+                raise HTTPException(status_code=400, detail="Subscription is not set to cancel at period end")
         
         # Reactivate the subscription
-        updated_subscription = stripe.Subscription.modify(
+        updated_subscription = await call_stripe(
+            stripe.Subscription.modify,
             subscription_id,
             cancel_at_period_end=False
         )
         
+        # Reflect the change in /status without waiting for the webhook
+        await asyncio.to_thread(subscription_status_cache.update_from_subscription, user.sub, updated_subscription)
+        
         return {
             "success": True,
             "message": "Subscription has been reactivated",
@@ -388,16 +457,15 @@ async def create_customer_portal_session(
     
     try:
         # Find the customer
-        customers = stripe.Customer.list(email=user.email)
+        customer_id = await get_customer_id(user)
         
-        if not customers or not customers.data:
+        if not customer_id:
             raise HTTPException(status_code=404, detail="No Stripe customer found for this user")
         
-        customer = customers.data[0]
-        
         # Create the session
-        session = stripe.billing_portal.Session.create(
-            customer=customer.id,
+        session = await call_stripe(
+            stripe.billing_portal.Session.create,
+            customer=customer_id,
             return_url=request.return_url,
         )
         
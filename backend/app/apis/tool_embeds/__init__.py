@@ -0,0 +1,66 @@
+import re
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+from app.libs.embed_store import ASSET_TYPES, load_asset, load_embed, render_embed
+
+# Served without auth (disableAuth in routers.json) so browsers can load embeds in iframes
+# and <script>/<link> tags, which can't send a Bearer token. Embeds and assets are
+# addressed by content hash, so their IDs are only known to whoever generated the tool.
+router = APIRouter()
+
+# A fetched copy never goes stale, and every user asking for the same hash gets the same bytes
+EMBED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Generated HTML runs scripts, so it gets an opaque origin: no access to the app's cookies,
+# storage or authenticated API calls even though it is served from the app's origin
+EMBED_CSP = "sandbox allow-scripts allow-forms allow-popups allow-modals"
+
+def not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+@router.get("/embeds/{embed_id}", operation_id="get_tool_embed")
+async def get_tool_embed(embed_id: str, request: Request, inline: bool = True) -> Response:
+    """
+    HTML for a tool's embed_id. By default the styles and scripts are inlined, giving the
+    original embed_code; with inline=false they are linked from /embeds/assets/ so browsers
+    cache assets shared between tools.
+    """
+    if not re.fullmatch(r"[0-9a-f]{32}", embed_id):
+        raise HTTPException(status_code=404, detail="Embed not found")
+    
+    etag = f'"{embed_id}-{"inline" if inline else "linked"}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": EMBED_CACHE_CONTROL,
+        "Content-Security-Policy": EMBED_CSP,
+        "X-Content-Type-Options": "nosniff"
+    }
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    document = await load_embed(embed_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Embed not found")
+    
+    return Response(content=await render_embed(document, inline=inline), media_type="text/html", headers=headers)
+
+@router.get("/embeds/assets/{asset_file}", operation_id="get_tool_embed_asset")
+async def get_tool_embed_asset(asset_file: str, request: Request) -> Response:
+    """A CSS or JS asset split out of stored embed code, e.g. /embeds/assets/{asset_id}.css"""
+    match = re.fullmatch(r"([0-9a-f]{32})\.(css|js)", asset_file)
+    if not match:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    
+    asset_id, extension = match.groups()
+    etag = f'"{asset_id}"'
+    headers = {"ETag": etag, "Cache-Control": EMBED_CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    content = await load_asset(asset_id)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    
+    media_type = next(media for ext, media in ASSET_TYPES.values() if ext == extension)
+    return Response(content=content, media_type=media_type, headers=headers)
@@ -1,20 +1,62 @@
+import asyncio
+import hashlib
 import json
 import databutton as db
 import re
-from typing import List, Optional
-from pydantic import BaseModel, Field
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, AsyncIterator
+from pydantic import BaseModel, Field, ValidationError
 from fastapi import APIRouter, HTTPException
-from openai import OpenAI, AzureOpenAI
+from fastapi.responses import StreamingResponse
 import os
+from app.auth import AdminUser, AuthorizedUser
+from app.libs.embed_store import store_embed
+from app.libs.incremental_json import JsonArrayStreamParser
+from app.libs.job_queue import JobQueue
+from app.libs.latency_histogram import get_latency_histogram
+from app.libs.lru_cache import LRUCache
+from app.libs.openai_clients import completion_slot, get_azure_openai_client, get_openai_client
 
 router = APIRouter()
 
+# Each tool is a full HTML page of completion output (and a concurrent completion when fanned out).
+# Larger max_results values are clamped to this rather than rejected, so existing clients keep working.
+MAX_RESULTS = 6
+
+# Generated tools are reused for requests with the same normalized category, complexity
+# and prompt. A cached set can serve any max_results up to its size.
+TOOL_CACHE_TTL = timedelta(days=7)
+TOOL_CACHE_PERSIST = True  # Also keep entries in db.storage.json so they survive restarts
+
+tool_cache = LRUCache(
+    max_entries=500,
+    max_bytes=50 * 1024 * 1024,
+    ttl_seconds=TOOL_CACHE_TTL.total_seconds()
+)
+
+# Hedging policy: Azure OpenAI (when configured) gets every request first. Without a first
+# token within the budget, the request is also sent to standard OpenAI and the faster one wins.
+HEDGE_ENABLED = True
+HEDGE_BUDGET_DEFAULT = 6.0  # Seconds, until Azure has enough latency samples
+HEDGE_BUDGET_MIN = 2.0
+HEDGE_BUDGET_MAX = 20.0
+HEDGE_BUDGET_QUANTILE = 0.95  # Hedge roughly the slowest 5% of Azure requests
+HEDGE_MIN_SAMPLES = 20
+
+BACKEND_AZURE = "azure"
+BACKEND_OPENAI = "openai"
+
+hedge_stats = {"requests": 0, "hedged": 0, "azure_wins": 0, "openai_wins": 0}
+
 # Pydantic models for request/response
 class ToolGenerationRequest(BaseModel):
     category: str
     prompt: str = ""
     complexity: str
-    max_results: int = 3
+    max_results: int = 3  # Clamped to 1..MAX_RESULTS by clamp_max_results
+    fan_out: bool = False  # One concurrent completion per tool instead of one for all of them
+    compact_embeds: bool = False  # Return embed_id references instead of inline embed_code
 
 class MonetizationIdea(BaseModel):
     idea: str
@@ -36,251 +78,865 @@ class ToolSuggestion(BaseModel):
     keywords: List[KeywordSuggestion]
     monetization_ideas: List[MonetizationIdea]
     embed_code: Optional[str] = None
+    embed_id: Optional[str] = None  # Set with compact_embeds: content hash of embed_code, served at /embeds/{embed_id}
 
 class ToolGenerationResponse(BaseModel):
     tools: List[ToolSuggestion]
 
-@router.post("/generate", operation_id="generate_tool_ideas")
-def generate_tool_ideas(request: ToolGenerationRequest) -> ToolGenerationResponse:
+class ToolGenerationJob(BaseModel):
+    job_id: str
+    status: str  # queued, running, completed or failed
+    result: Optional[ToolGenerationResponse] = None
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+
+class ToolCatalogResponse(BaseModel):
+    tools: List[ToolSuggestion]
+    source: str  # catalog or live
+    version: Optional[int] = None
+    generated_at: Optional[str] = None
+
+class CatalogRefreshRequest(BaseModel):
+    categories: Optional[List[str]] = None  # Defaults to CATALOG_CATEGORIES
+    complexities: Optional[List[str]] = None  # Defaults to CATALOG_COMPLEXITIES
+
+class CatalogRefreshResponse(BaseModel):
+    started: bool
+    detail: str
+
+class ToolStreamEvent(BaseModel):
+    event: str  # tool, error or complete
+    tool: Optional[ToolSuggestion] = None
+    detail: Optional[str] = None
+
+SYSTEM_PROMPT = """
+You are an expert tool designer and marketing strategist specialized in creating
+tools, templates, and calculators that connect free content to high-value monetization opportunities.
+
+For each tool idea you generate, provide:
+1. A compelling title and description
+2. Detailed implementation specifics (what it should include, features, formulas, design elements)
+3. Specific relevant keywords with search volume, competition estimates, and CPC values
+4. Concrete monetization strategies detailing how to connect this free tool to high-value offers
+5. Detailed HTML code for embedding this tool on a website, with proper JavaScript functionality
+
+Focus on the "Hidden Money Door" concept - where low-competition keywords can lead to high-value
+monetization opportunities. Be specific about the implementation details for spreadsheets, calculators, 
+or other tool formats.
+
+For keywords, ensure you provide:
+- Realistic search volume estimates as numeric values (e.g., "1,200")
+- Competition levels (Low, Medium, High)
+- Suggested CPC values with dollar signs (e.g., "$1.50")
+- Keywords that specifically relate to the tool but could lead to higher-value monetization
+
+For monetization ideas, be specific about:
+- The exact product or service being promoted
+- How it connects to the free tool
+- Potential value or commission (with specific dollar amounts)
+
+For the embed code, provide:
+- Clean, functional HTML, CSS, and JavaScript
+- Responsive design elements that work on different screen sizes
+- Properly escaped code that can be embedded in an iframe or directly in a website
+- Any necessary external libraries or dependencies
+"""
+
+# Fan-out completions each produce one tool; rotating the format keeps concurrent ideas apart
+FAN_OUT_TOOL_FORMATS = [
+    "calculator",
+    "spreadsheet template",
+    "planner or tracker",
+    "checklist or assessment quiz",
+    "comparison tool",
+    "dashboard or report generator",
+]
+
+def build_user_prompt(request: ToolGenerationRequest, count: Optional[int] = None, tool_format: Optional[str] = None) -> str:
+    """Build the user prompt asking for count tools (request.max_results by default)"""
+    count = count or request.max_results
+    user_prompt = f"""
+    Create {count} detailed tool idea{"s" if count != 1 else ""} related to {request.category} at a {request.complexity} complexity level.
+    
+    {"Specific focus: " + request.prompt if request.prompt else ""}
+    {"Tool format: a " + tool_format if tool_format else ""}
+    
+    For each tool:
+    1. Provide a clear title and compelling description
+    2. Include specific implementation details (formulas, fields, features it should have)
+    3. Suggest 4-6 relevant keywords with real-world search volume estimates in numeric format (e.g., "1,200"), specific competition level (Low/Medium/High), and approximate CPC with dollar sign (e.g., "$1.50")
+    4. Create 3-4 detailed monetization strategies explaining exactly how to connect this free tool to high-value offers, with specific potential value or commission amounts
+    5. Provide HTML/CSS/JS code that creates an interactive, embeddable version of this tool
+    
+    Format your response as a JSON object with a 'tools' array containing tool objects with these properties:
+    - title (string): The name of the tool
+    - description (string): A compelling description of the tool
+    - implementation_details (string): Specific details on what the tool includes, formulas, etc.
+    - category (string): The category (should match "{request.category}")
+    - complexity (string): The complexity level (should match "{request.complexity}")
+    - keywords (array of objects): Each with 'keyword', 'search_volume', 'competition', and 'suggested_cpc'
+    - monetization_ideas (array of objects): Each with 'idea', 'description', and 'potential_value'
+    - embed_code (string): HTML/CSS/JS code that creates a functional version of the tool
+    
+    Example format:
+    {{"tools": [
+      {{"title": "Tool Name", "description": "Tool description", "implementation_details": "Details...", "category": "{request.category}", "complexity": "{request.complexity}", 
+        "keywords": [{{"keyword": "example keyword", "search_volume": "1,500", "competition": "Low", "suggested_cpc": "$0.95"}}],
+        "monetization_ideas": [{{"idea": "Premium Version", "description": "Offer a premium version with more features", "potential_value": "$29 per month"}}],
+        "embed_code": "<div class=\\"tool-container\\">...</div>"}}
+    ]}}
     """
-    Generate tool ideas using OpenAI with detailed monetization strategies and keyword suggestions.
+    return user_prompt
+
+def build_messages(user_prompt: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+async def stream_backend(backend: str, messages: list, max_tokens: int) -> AsyncIterator[str]:
+    """Stream one backend's content deltas, recording first-token and total latency"""
+    if backend == BACKEND_AZURE:
+        # Azure OpenAI uses deployment names instead of model names
+        client, model = get_azure_openai_client(), "gpt-4o"  # Replace with your actual deployment name
+    else:
+        client, model = get_openai_client(), "gpt-4o-mini"  # Using the mini model for cost efficiency
+    
+    first_token = get_latency_histogram(f"tool_generator_first_token_{backend}")
+    started = time.monotonic()
+    received = False
+    try:
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,  # Slightly creative but still focused
+            max_tokens=max_tokens,  # Allow for detailed responses
+            response_format={"type": "json_object"},
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                if not received:
+                    first_token.record(time.monotonic() - started)
+                    received = True
+                yield chunk.choices[0].delta.content
+    except asyncio.CancelledError:
+        # A request hedged away before its first token still shows the token took at least this long
+        if not received:
+            first_token.record(time.monotonic() - started)
+        raise
+    
+    get_latency_histogram(f"tool_generator_total_{backend}").record(time.monotonic() - started)
+
+async def pump_backend(backend: str, messages: list, max_tokens: int, queue: asyncio.Queue) -> None:
+    """Feed a backend's deltas into queue as (backend, text), ending with None or the exception"""
+    try:
+        async for text in stream_backend(backend, messages, max_tokens):
+            queue.put_nowait((backend, text))
+        queue.put_nowait((backend, None))
+    except Exception as e:
+        queue.put_nowait((backend, e))
+
+def get_hedge_budget() -> float:
+    """Seconds to wait for Azure's first token before hedging, adapted to its recent latency"""
+    histogram = get_latency_histogram(f"tool_generator_first_token_{BACKEND_AZURE}")
+    if histogram.weight() < HEDGE_MIN_SAMPLES:
+        return HEDGE_BUDGET_DEFAULT
+    return min(max(histogram.quantile(HEDGE_BUDGET_QUANTILE), HEDGE_BUDGET_MIN), HEDGE_BUDGET_MAX)
+
+async def hedged_stream(user_prompt: str, max_tokens: int = 2500, finish_first: bool = False) -> AsyncIterator[str]:
+    """
+    Yield the completion's content deltas, from Azure OpenAI when configured and standard
+    OpenAI otherwise. If Azure has no first token within the hedge budget, the request also
+    goes to standard OpenAI; the winner is the first backend to produce a token, or with
+    finish_first the first to complete, and the other is cancelled. If Azure fails outright,
+    standard OpenAI is tried as before.
+    
+    Callers hold a completion_slot() for as long as the stream is in use; a hedged pair
+    shares that slot.
     """
+    messages = build_messages(user_prompt)
+    hedge_stats["requests"] += 1
+    
+    if not get_azure_openai_client():
+        async for text in stream_backend(BACKEND_OPENAI, messages, max_tokens):
+            yield text
+        return
+    
+    queue = asyncio.Queue()
+    pumps = {}
+    buffers = {}
+    
+    def start(backend: str) -> None:
+        buffers[backend] = []
+        pumps[backend] = asyncio.create_task(pump_backend(backend, messages, max_tokens, queue))
+    
+    start(BACKEND_AZURE)
+    hedge_at = time.monotonic() + get_hedge_budget()
+    winner = None
+    winner_done = False
+    failed = set()
+    error = None
+    
     try:
-        # Get OpenAI API key and project ID
-        api_key = db.secrets.get("OPENAI_API_KEY")
-        project_id = db.secrets.get("OPENAI_PROJECT_ID")
-        
-        if not api_key:
-            raise HTTPException(status_code=500, detail="OpenAI API key not configured")
-        
-        # Create OpenAI client with Azure configuration if project ID is provided
-        if project_id:
+        while winner is None:
+            timeout = None
+            if HEDGE_ENABLED and BACKEND_OPENAI not in pumps and not buffers[BACKEND_AZURE]:
+                timeout = max(hedge_at - time.monotonic(), 0)
             try:
-                client = AzureOpenAI(
-                    api_key=api_key,
-                    api_version="2023-12-01-preview",
-                    azure_endpoint=f"https://{project_id}.openai.azure.com"
-                )
-                print(f"Using Azure OpenAI with project ID: {project_id}")
-            except Exception as e:
-                print(f"Error initializing Azure OpenAI: {e}. Falling back to standard OpenAI API.")
-                client = OpenAI(api_key=api_key)
-        else:
-            client = OpenAI(api_key=api_key)
-            print("Using standard OpenAI API")
-        
-        # Build the prompt for the OpenAI API
-        print(f"Generating ideas for {request.category} with {request.complexity} complexity")
-        system_prompt = """
-        You are an expert tool designer and marketing strategist specialized in creating
-        tools, templates, and calculators that connect free content to high-value monetization opportunities.
-        
-        For each tool idea you generate, provide:
-        1. A compelling title and description
-        2. Detailed implementation specifics (what it should include, features, formulas, design elements)
-        3. Specific relevant keywords with search volume, competition estimates, and CPC values
-        4. Concrete monetization strategies detailing how to connect this free tool to high-value offers
-        5. Detailed HTML code for embedding this tool on a website, with proper JavaScript functionality
+                backend, item = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"No Azure OpenAI token within {get_hedge_budget():.1f}s, hedging with standard OpenAI")
+                hedge_stats["hedged"] += 1
+                start(BACKEND_OPENAI)
+                continue
+            
+            if isinstance(item, str):
+                buffers[backend].append(item)
+                if not finish_first:
+                    winner = backend
+            elif item is None and buffers[backend]:
+                winner, winner_done = backend, True
+            else:
+                # Failed, or completed without content
+                failed.add(backend)
+                error = item or error
+                print(f"Error calling {backend} OpenAI API: {item}")
+                if BACKEND_OPENAI not in pumps:
+                    print("Trying with standard OpenAI API as fallback")
+                    start(BACKEND_OPENAI)
+                elif failed == set(pumps):
+                    if error:
+                        raise error
+                    return
         
-        Focus on the "Hidden Money Door" concept - where low-competition keywords can lead to high-value
-        monetization opportunities. Be specific about the implementation details for spreadsheets, calculators, 
-        or other tool formats.
+        hedge_stats[f"{winner}_wins"] += 1
+        for backend, pump in pumps.items():
+            if backend != winner:
+                pump.cancel()
         
-        For keywords, ensure you provide:
-        - Realistic search volume estimates as numeric values (e.g., "1,200")
-        - Competition levels (Low, Medium, High)
-        - Suggested CPC values with dollar signs (e.g., "$1.50")
-        - Keywords that specifically relate to the tool but could lead to higher-value monetization
+        for text in buffers[winner]:
+            yield text
         
-        For monetization ideas, be specific about:
-        - The exact product or service being promoted
-        - How it connects to the free tool
-        - Potential value or commission (with specific dollar amounts)
+        while not winner_done:
+            backend, item = await queue.get()
+            if backend != winner:
+                continue
+            if isinstance(item, Exception):
+                raise item
+            if item is None:
+                break
+            yield item
+    finally:
+        for pump in pumps.values():
+            pump.cancel()
+
+async def complete_text(user_prompt: str, max_tokens: int = 2500) -> str:
+    """Run a hedged completion and return its full content"""
+    return "".join([text async for text in hedged_stream(user_prompt, max_tokens, finish_first=True)])
+
+def normalize_tool_data(response_data, request: ToolGenerationRequest) -> dict:
+    """Coerce the various response shapes the model returns into {"tools": [...]}"""
+    # Handle various possible response formats
+    if "tools" in response_data:
+        # Already in correct format
+        tool_data = response_data
+    elif "financial_tools" in response_data:
+        # Handle format with financial_tools array
+        tool_data = {"tools": response_data["financial_tools"]}
+    elif isinstance(response_data, list):
+        # Direct list of tools
+        tool_data = {"tools": response_data}
+        print(f"Format corrected: Converted direct list to object with tools array")
+    else:
+        # Look for any array that might contain tools
+        found_array = None
+        for key, value in response_data.items():
+            if isinstance(value, list) and len(value) > 0:
+                found_array = value
+                break
+                
+        if found_array:
+            tool_data = {"tools": found_array}
+        else:    
+            # If all else fails, wrap the entire response as a single tool
+            # Construct a valid tool object
+            tool = {
+                "title": response_data.get("title", "Financial Tool"),
+                "description": response_data.get("description", "Generated financial tool"),
+                "implementation_details": response_data.get("implementation_details", "Generated by AI"),
+                "category": request.category,
+                "complexity": request.complexity,
+                "keywords": response_data.get("keywords", [{
+                    "keyword": f"{request.category} tool",
+                    "search_volume": "Medium",
+                    "competition": "Medium",
+                    "suggested_cpc": "$1.00"
+                }]),
+                "monetization_ideas": response_data.get("monetization_ideas", [{
+                    "idea": "Premium version",
+                    "description": "Offer a premium version with additional features",
+                    "potential_value": "Medium"
+                }])
+            }
+            tool_data = {"tools": [tool]}
+    
+    return tool_data
+
+def repair_tool(tool: dict, request: ToolGenerationRequest) -> dict:
+    """Ensure a tool has keywords, monetization ideas and embed code"""
+    # Ensure keywords is a non-empty array of objects
+    if not tool.get("keywords") or not isinstance(tool["keywords"], list) or len(tool["keywords"]) == 0:
+        tool["keywords"] = [
+            {"keyword": f"{request.category} {tool['title'].lower()}", "search_volume": "1,200", "competition": "Medium", "suggested_cpc": "$1.00"},
+            {"keyword": f"free {request.category} tool", "search_volume": "2,400", "competition": "Low", "suggested_cpc": "$0.75"}
+        ]
+        print(f"Fixed missing keywords for {tool['title']}")
+    
+    # Ensure monetization_ideas is a non-empty array of objects
+    if not tool.get("monetization_ideas") or not isinstance(tool["monetization_ideas"], list) or len(tool["monetization_ideas"]) == 0:
+        tool["monetization_ideas"] = [
+            {"idea": "Premium version", "description": f"Enhanced version of the {tool['title']} with advanced features", "potential_value": "$19.99 per month"},
+            {"idea": "Affiliate partnerships", "description": "Connect users to relevant products and services", "potential_value": "$50-100 per conversion"}
+        ]
+        print(f"Fixed missing monetization ideas for {tool['title']}")
         
-        For the embed code, provide:
-        - Clean, functional HTML, CSS, and JavaScript
-        - Responsive design elements that work on different screen sizes
-        - Properly escaped code that can be embedded in an iframe or directly in a website
-        - Any necessary external libraries or dependencies
-        """
+    # Ensure embed_code is present
+    if not tool.get("embed_code") or not isinstance(tool["embed_code"], str) or len(tool["embed_code"]) < 50:
+        basic_html = f'''
+        <div class="tool-container" style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #e0e0e0; border-radius: 8px;">
+          <h2 style="color: #333; margin-top: 0;">{tool['title']}</h2>
+          <p style="color: #666;">{tool['description']}</p>
+          <div class="tool-content" style="margin: 20px 0;">
+            <!-- Tool content would go here -->
+            <p style="font-style: italic; color: #999;">This is a placeholder for the {tool['title']} tool. The actual implementation would include interactive elements.</p>
+          </div>
+          <div class="tool-footer" style="font-size: 12px; color: #999; text-align: center;">
+            Powered by <a href="https://www.themoneygate.com" style="color: #0066cc; text-decoration: none;">TheMoneyGate</a>
+          </div>
+        </div>
+        '''
+        tool["embed_code"] = basic_html.strip()
+        print(f"Added basic embed_code for {tool['title']}")
+    
+    return tool
+
+def parse_tool_response(response_text: str, request: ToolGenerationRequest) -> ToolGenerationResponse:
+    """Parse, normalize and repair the model's JSON into a ToolGenerationResponse"""
+    try:
+        print(f"Raw response first 200 chars: {response_text[:200]}...")
+        response_data = json.loads(response_text)
         
-        user_prompt = f"""
-        Create {request.max_results} detailed tool ideas related to {request.category} at a {request.complexity} complexity level.
+        tool_data = normalize_tool_data(response_data, request)
         
-        {"Specific focus: " + request.prompt if request.prompt else ""}
+        # Print the formatted data for debugging
+        print(f"Formatted tool data: {json.dumps(tool_data)[:200]}...")
         
-        For each tool:
-        1. Provide a clear title and compelling description
-        2. Include specific implementation details (formulas, fields, features it should have)
-        3. Suggest 4-6 relevant keywords with real-world search volume estimates in numeric format (e.g., "1,200"), specific competition level (Low/Medium/High), and approximate CPC with dollar sign (e.g., "$1.50")
-        4. Create 3-4 detailed monetization strategies explaining exactly how to connect this free tool to high-value offers, with specific potential value or commission amounts
-        5. Provide HTML/CSS/JS code that creates an interactive, embeddable version of this tool
+        # Extra validation to ensure we have proper keywords and monetization ideas
+        for tool in tool_data.get("tools", []):
+            repair_tool(tool, request)
         
-        Format your response as a JSON object with a 'tools' array containing tool objects with these properties:
-        - title (string): The name of the tool
-        - description (string): A compelling description of the tool
-        - implementation_details (string): Specific details on what the tool includes, formulas, etc.
-        - category (string): The category (should match "{request.category}")
-        - complexity (string): The complexity level (should match "{request.complexity}")
-        - keywords (array of objects): Each with 'keyword', 'search_volume', 'competition', and 'suggested_cpc'
-        - monetization_ideas (array of objects): Each with 'idea', 'description', and 'potential_value'
-        - embed_code (string): HTML/CSS/JS code that creates a functional version of the tool
+        # Validate and return the response
+        return ToolGenerationResponse(**tool_data)
+    except json.JSONDecodeError as e:
+        print(f"Error parsing JSON: {e}")
+        print(f"Raw response: {response_text}")
+        raise HTTPException(status_code=500, detail=f"Invalid response format from AI: {e}")
+
+async def generate_single_tool(request: ToolGenerationRequest, index: int) -> Optional[ToolSuggestion]:
+    """Generate one tool for a fan-out request, or None if its completion fails or is unusable"""
+    tool_format = FAN_OUT_TOOL_FORMATS[index % len(FAN_OUT_TOOL_FORMATS)]
+    try:
+        async with completion_slot():
+            response_text = await complete_text(build_user_prompt(request, count=1, tool_format=tool_format))
         
-        Example format:
-        {{"tools": [
-          {{"title": "Tool Name", "description": "Tool description", "implementation_details": "Details...", "category": "{request.category}", "complexity": "{request.complexity}", 
-            "keywords": [{{"keyword": "example keyword", "search_volume": "1,500", "competition": "Low", "suggested_cpc": "$0.95"}}],
-            "monetization_ideas": [{{"idea": "Premium Version", "description": "Offer a premium version with more features", "potential_value": "$29 per month"}}],
-            "embed_code": "<div class=\\"tool-container\\">...</div>"}}
-        ]}}
-        """
+        tools = parse_tool_response(response_text, request).tools
+        return tools[0] if tools else None
+    except Exception as e:
+        print(f"Error generating fan-out tool {index + 1}/{request.max_results} ({tool_format}): {str(e)}")
+        return None
+
+async def iter_fan_out_tools(request: ToolGenerationRequest) -> AsyncIterator[ToolSuggestion]:
+    """
+    Run one completion per tool concurrently and yield each distinct tool as it completes.
+    A failed or truncated completion only loses its own tool.
+    """
+    print(f"Fanning out {request.max_results} completions for category: {request.category}, complexity: {request.complexity}")
+    tasks = [asyncio.create_task(generate_single_tool(request, index)) for index in range(request.max_results)]
+    seen_titles = set()
+    
+    try:
+        for next_tool in asyncio.as_completed(tasks):
+            tool = await next_tool
+            if tool is None:
+                continue
+            
+            title_key = normalize_text(tool.title)
+            if title_key in seen_titles:
+                print(f"Dropping duplicate fan-out tool: {tool.title}")
+                continue
+            seen_titles.add(title_key)
+            yield tool
+    finally:
+        # The consumer may stop early (e.g. a disconnected stream)
+        for task in tasks:
+            task.cancel()
+
+async def run_generation(request: ToolGenerationRequest) -> ToolGenerationResponse:
+    """Generate tools for the request without consulting the cache"""
+    if request.fan_out:
+        tools = [tool async for tool in iter_fan_out_tools(request)]
+        if not tools:
+            raise HTTPException(status_code=500, detail="All fan-out completions failed")
+        return ToolGenerationResponse(tools=tools)
+    
+    # Build the prompt for the OpenAI API
+    print(f"Generating ideas for {request.category} with {request.complexity} complexity")
+    user_prompt = build_user_prompt(request)
+    
+    # Call OpenAI API
+    print(f"Generating tool ideas for category: {request.category}, complexity: {request.complexity}")
+    async with completion_slot():
+        response_text = await complete_text(user_prompt)
+    
+    return parse_tool_response(response_text, request)
+
+def clamp_max_results(max_results: int) -> int:
+    """Bound a requested tool count to 1..MAX_RESULTS"""
+    return max(1, min(max_results, MAX_RESULTS))
+
+@router.post("/generate", operation_id="generate_tool_ideas")
+async def generate_tool_ideas(request: ToolGenerationRequest) -> ToolGenerationResponse:
+    """
+    Generate tool ideas using OpenAI with detailed monetization strategies and keyword suggestions.
+    With fan_out, each tool comes from its own concurrent completion and duplicate titles are dropped.
+    max_results above MAX_RESULTS is clamped to it.
+    """
+    request = request.copy(update={"max_results": clamp_max_results(request.max_results)})
+    cached_response = await get_cached_tools(request)
+    if cached_response is not None:
+        return ToolGenerationResponse(tools=await with_embed_refs(cached_response.tools, request.compact_embeds))
+    
+    try:
+        tool_response = await run_generation(request)
+        tools = await with_embed_refs(tool_response.tools, request.compact_embeds)
+        await cache_tools(request, tool_response)
         
-        # Call OpenAI API
-        print(f"Generating tool ideas for category: {request.category}, complexity: {request.complexity}")
+        return ToolGenerationResponse(tools=tools)
+            
+    except Exception as e:
+        print(f"Error generating tool ideas: {str(e)}")
+        # Return a more friendly error to the user
+        raise HTTPException(status_code=500, detail="Error generating tool ideas. Please try again.")
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so near-identical inputs match"""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+def get_tool_cache_key(request: ToolGenerationRequest) -> str:
+    """Storage-safe cache key for a request, independent of max_results"""
+    normalized = "|".join([normalize_text(request.category), normalize_text(request.complexity), normalize_text(request.prompt)])
+    return f"tool_ideas_{hashlib.sha256(normalized.encode()).hexdigest()[:32]}"
+
+async def get_cached_tools(request: ToolGenerationRequest) -> Optional[ToolGenerationResponse]:
+    """
+    Return cached tools for the request, sliced to max_results, or None if the
+    cache has no entry with at least max_results tools
+    """
+    cache_key = get_tool_cache_key(request)
+    cached_response = tool_cache.get(cache_key)
+    
+    if cached_response is None and TOOL_CACHE_PERSIST:
         try:
-            if project_id:
-                # Azure OpenAI uses deployment names instead of model names
-                response = client.chat.completions.create(
-                    model="gpt-4o",  # Replace with your actual deployment name
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7,  # Slightly creative but still focused
-                    max_tokens=2500,  # Allow for detailed responses
-                    response_format={"type": "json_object"}
-                )
-            else:
-                # Standard OpenAI API
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",  # Using the mini model for cost efficiency
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7,  # Slightly creative but still focused
-                    max_tokens=2500,  # Allow for detailed responses
-                    response_format={"type": "json_object"}
-                )
+            cached_result = await asyncio.to_thread(db.storage.json.get, cache_key)
+            if cached_result and 'cached_date' in cached_result:
+                age = datetime.now() - datetime.fromisoformat(cached_result['cached_date'])
+                if age < TOOL_CACHE_TTL:
+                    cached_response = ToolGenerationResponse(tools=cached_result['tools'])
+                    tool_cache.set(cache_key, cached_response, ttl_seconds=(TOOL_CACHE_TTL - age).total_seconds())
         except Exception as e:
-            print(f"Error calling OpenAI API: {e}")
-            # If there's an error with the Azure deployment name, try with a standard model
-            if project_id:
-                print("Trying with standard OpenAI API as fallback")
-                client = OpenAI(api_key=api_key)
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=2500,
-                    response_format={"type": "json_object"}
-                )
-            else:
-                raise
-        
-        # Extract the response text
-        response_text = response.choices[0].message.content
-        
-        # Parse the response JSON
+            print(f"Tool cache retrieval error: {e}")
+    
+    if cached_response is None or len(cached_response.tools) < request.max_results:
+        return None
+    
+    print(f"Serving {request.max_results} of {len(cached_response.tools)} cached tools for {request.category}")
+    return ToolGenerationResponse(tools=cached_response.tools[:request.max_results])
+
+async def cache_tools(request: ToolGenerationRequest, response: ToolGenerationResponse) -> None:
+    """Cache generated tools unless a larger set is already cached for the request"""
+    if not response.tools:
+        return
+    
+    cache_key = get_tool_cache_key(request)
+    existing = tool_cache.get(cache_key)
+    if existing is not None and len(existing.tools) >= len(response.tools):
+        return
+    
+    tool_cache.set(cache_key, response)
+    if TOOL_CACHE_PERSIST:
         try:
-            print(f"Raw response first 200 chars: {response_text[:200]}...")
-            response_data = json.loads(response_text)
-            
-            # Handle various possible response formats
-            if "tools" in response_data:
-                # Already in correct format
-                tool_data = response_data
-            elif "financial_tools" in response_data:
-                # Handle format with financial_tools array
-                tool_data = {"tools": response_data["financial_tools"]}
-            elif isinstance(response_data, list):
-                # Direct list of tools
-                tool_data = {"tools": response_data}
-                print(f"Format corrected: Converted direct list to object with tools array")
-            else:
-                # Look for any array that might contain tools
-                found_array = None
-                for key, value in response_data.items():
-                    if isinstance(value, list) and len(value) > 0:
-                        found_array = value
-                        break
-                        
-                if found_array:
-                    tool_data = {"tools": found_array}
-                else:    
-                    # If all else fails, wrap the entire response as a single tool
-                    # Construct a valid tool object
-                    tool = {
-                        "title": response_data.get("title", "Financial Tool"),
-                        "description": response_data.get("description", "Generated financial tool"),
-                        "implementation_details": response_data.get("implementation_details", "Generated by AI"),
-                        "category": request.category,
-                        "complexity": request.complexity,
-                        "keywords": response_data.get("keywords", [{
-                            "keyword": f"{request.category} tool",
-                            "search_volume": "Medium",
-                            "competition": "Medium",
-                            "suggested_cpc": "$1.00"
-                        }]),
-                        "monetization_ideas": response_data.get("monetization_ideas", [{
-                            "idea": "Premium version",
-                            "description": "Offer a premium version with additional features",
-                            "potential_value": "Medium"
-                        }])
-                    }
-                    tool_data = {"tools": [tool]}
-            
-            # Print the formatted data for debugging
-            print(f"Formatted tool data: {json.dumps(tool_data)[:200]}...")
+            cache_data = json.loads(response.json())
+            cache_data['cached_date'] = datetime.now().isoformat()
+            await asyncio.to_thread(db.storage.json.put, cache_key, cache_data)
+        except Exception as e:
+            print(f"Error caching tools: {e}")
+
+async def store_tool_embed(tool: ToolSuggestion) -> bool:
+    """Store the tool's embed code unless its embed_id is already set; False if storing failed"""
+    if not tool.embed_id:
+        try:
+            tool.embed_id = await store_embed(tool.embed_code)
+        except Exception as e:
+            print(f"Error storing embed code for {tool.title}: {e}")
+            return False
+    return True
+
+async def with_embed_ref(tool: ToolSuggestion, compact: bool) -> ToolSuggestion:
+    """
+    With compact, store the tool's embed code, set its embed_id and drop the inline copy.
+    Without it the tool is returned as is, so inline responses don't write to storage.
+    """
+    if not compact or not tool.embed_code or not await store_tool_embed(tool):
+        return tool
+    return tool.copy(update={"embed_code": None})
+
+async def with_embed_refs(tools: List[ToolSuggestion], compact: bool) -> List[ToolSuggestion]:
+    return [await with_embed_ref(tool, compact) for tool in tools]
+
+async def stream_completion_text(user_prompt: str) -> AsyncIterator[str]:
+    """Yield the completion's content deltas as they arrive"""
+    async with completion_slot():
+        async for text in hedged_stream(user_prompt):
+            yield text
+
+async def stream_tool_ideas(request: ToolGenerationRequest) -> AsyncIterator[str]:
+    """
+    Yield one NDJSON event per tool as soon as its JSON object closes in the token stream
+    """
+    cached_response = await get_cached_tools(request)
+    if cached_response is not None:
+        for suggestion in cached_response.tools:
+            yield ToolStreamEvent(event="tool", tool=await with_embed_ref(suggestion, request.compact_embeds)).json() + "\n"
+        yield ToolStreamEvent(event="complete").json() + "\n"
+        return
+    
+    parser = JsonArrayStreamParser()
+    emitted = []
+    
+    try:
+        if request.fan_out:
+            async for suggestion in iter_fan_out_tools(request):
+                emitted.append(suggestion)
+                yield ToolStreamEvent(event="tool", tool=await with_embed_ref(suggestion, request.compact_embeds)).json() + "\n"
             
-            # Extra validation to ensure we have proper keywords and monetization ideas
-            for tool in tool_data.get("tools", []):
-                # Ensure keywords is a non-empty array of objects
-                if not tool.get("keywords") or not isinstance(tool["keywords"], list) or len(tool["keywords"]) == 0:
-                    tool["keywords"] = [
-                        {"keyword": f"{request.category} {tool['title'].lower()}", "search_volume": "1,200", "competition": "Medium", "suggested_cpc": "$1.00"},
-                        {"keyword": f"free {request.category} tool", "search_volume": "2,400", "competition": "Low", "suggested_cpc": "$0.75"}
-                    ]
-                    print(f"Fixed missing keywords for {tool['title']}")
-                
-                # Ensure monetization_ideas is a non-empty array of objects
-                if not tool.get("monetization_ideas") or not isinstance(tool["monetization_ideas"], list) or len(tool["monetization_ideas"]) == 0:
-                    tool["monetization_ideas"] = [
-                        {"idea": "Premium version", "description": f"Enhanced version of the {tool['title']} with advanced features", "potential_value": "$19.99 per month"},
-                        {"idea": "Affiliate partnerships", "description": "Connect users to relevant products and services", "potential_value": "$50-100 per conversion"}
-                    ]
-                    print(f"Fixed missing monetization ideas for {tool['title']}")
-                    
-                # Ensure embed_code is present
-                if not tool.get("embed_code") or not isinstance(tool["embed_code"], str) or len(tool["embed_code"]) < 50:
-                    basic_html = f'''
-                    <div class="tool-container" style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #e0e0e0; border-radius: 8px;">
-                      <h2 style="color: #333; margin-top: 0;">{tool['title']}</h2>
-                      <p style="color: #666;">{tool['description']}</p>
-                      <div class="tool-content" style="margin: 20px 0;">
-                        <!-- Tool content would go here -->
-                        <p style="font-style: italic; color: #999;">This is a placeholder for the {tool['title']} tool. The actual implementation would include interactive elements.</p>
-                      </div>
-                      <div class="tool-footer" style="font-size: 12px; color: #999; text-align: center;">
-                        Powered by <a href="https://www.themoneygate.com" style="color: #0066cc; text-decoration: none;">TheMoneyGate</a>
-                      </div>
-                    </div>
-                    '''
-                    tool["embed_code"] = basic_html.strip()
-                    print(f"Added basic embed_code for {tool['title']}")
-                
-                
-            # Validate and return the response
-            return ToolGenerationResponse(**tool_data)
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON: {e}")
-            print(f"Raw response: {response_text}")
-            raise HTTPException(status_code=500, detail=f"Invalid response format from AI: {e}")
+            if not emitted:
+                raise HTTPException(status_code=500, detail="All fan-out completions failed")
             
+            await cache_tools(request, ToolGenerationResponse(tools=emitted))
+            yield ToolStreamEvent(event="complete").json() + "\n"
+            return
+        
+        print(f"Streaming tool ideas for category: {request.category}, complexity: {request.complexity}")
+        async for text in stream_completion_text(build_user_prompt(request)):
+            for tool in parser.feed(text):
+                # Nested arrays of a single wrapped tool also show up here; only whole tools count
+                if not tool.get("title"):
+                    continue
+                try:
+                    suggestion = ToolSuggestion(**repair_tool(tool, request))
+                except (ValidationError, KeyError) as e:
+                    print(f"Skipping invalid streamed tool: {e}")
+                    continue
+                emitted.append(suggestion)
+                yield ToolStreamEvent(event="tool", tool=await with_embed_ref(suggestion, request.compact_embeds)).json() + "\n"
+        
+        # Response shapes without a tools array can only be handled once complete
+        if not emitted:
+            for suggestion in parse_tool_response(parser.text, request).tools:
+                emitted.append(suggestion)
+                yield ToolStreamEvent(event="tool", tool=await with_embed_ref(suggestion, request.compact_embeds)).json() + "\n"
+        
+        await cache_tools(request, ToolGenerationResponse(tools=emitted))
+        
+        yield ToolStreamEvent(event="complete").json() + "\n"
+    
     except Exception as e:
-        print(f"Error generating tool ideas: {str(e)}")
-        # Return a more friendly error to the user
-        raise HTTPException(status_code=500, detail="Error generating tool ideas. Please try again.")
+        print(f"Error streaming tool ideas: {str(e)}")
+        yield ToolStreamEvent(event="error", detail="Error generating tool ideas. Please try again.").json() + "\n"
+
+@router.post("/generate-stream", operation_id="generate_tool_ideas_stream")
+async def generate_tool_ideas_stream(request: ToolGenerationRequest) -> StreamingResponse:
+    """
+    Streaming variant of /generate (NDJSON). Emits each tool as soon as the model finishes it,
+    with the same keyword/monetization/embed_code repair, followed by a complete or error event.
+    """
+    request = request.copy(update={"max_results": clamp_max_results(request.max_results)})
+    return StreamingResponse(stream_tool_ideas(request), media_type="application/x-ndjson")
+
+@router.get("/generate/cache-stats", operation_id="tool_generation_cache_stats")
+def get_tool_cache_stats(user: AdminUser) -> Dict[str, Any]:
+    """Hit/miss counters and occupancy of the in-process tool generation cache (admins only)"""
+    return tool_cache.stats()
+
+async def run_generation_job(payload: dict) -> dict:
+    """Job handler: run a queued generation request through /generate's code path"""
+    response = await generate_tool_ideas(ToolGenerationRequest.parse_obj(payload))
+    return json.loads(response.json())
+
+# Generations accepted by /generate/jobs run on these workers; completion_slot() still
+# bounds the completions they start (fan-out jobs start several)
+GENERATION_JOB_TTL = timedelta(days=1)  # How long a finished job stays available for polling
+generation_jobs = JobQueue(
+    "tool_generation",
+    run_generation_job,
+    workers=4,
+    finished_ttl_seconds=GENERATION_JOB_TTL.total_seconds()
+)
+
+def to_job_response(job: dict) -> ToolGenerationJob:
+    return ToolGenerationJob(
+        job_id=job["id"],
+        status=job["status"],
+        result=job.get("result"),
+        error=job.get("error"),
+        created_at=job["created_at"],
+        updated_at=job["updated_at"]
+    )
+
+@router.post("/generate/jobs", operation_id="create_tool_generation_job")
+async def create_tool_generation_job(request: ToolGenerationRequest, user: AuthorizedUser) -> ToolGenerationJob:
+    """
+    Queue a tool generation and return its job ID immediately. Poll /generate/jobs/{job_id}
+    for the result; jobs are persisted and resume after a worker restart. Finished jobs
+    can be polled for GENERATION_JOB_TTL.
+    """
+    try:
+        job = await generation_jobs.submit(json.loads(request.json()), owner=user.sub)
+    except Exception as e:
+        print(f"Error queueing tool generation job: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error queueing tool generation. Please try again.")
+    
+    return to_job_response(job)
+
+@router.get("/generate/jobs/{job_id}", operation_id="get_tool_generation_job")
+async def get_tool_generation_job(job_id: str, user: AuthorizedUser) -> ToolGenerationJob:
+    """Status of a queued tool generation, with the tools once it has completed"""
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    job = await generation_jobs.get(job_id)
+    # Other users' jobs look the same as missing ones
+    if job is None or job.get("owner") != user.sub:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return to_job_response(job)
+
+# Pre-generated catalog for the category/complexity grid the ToolGenerator page offers.
+# A batch run stores every cell as tool_catalog_v{n} and then moves tool_catalog_current
+# to it, so readers always see a complete version.
+CATALOG_CATEGORIES = ["savings", "debt", "investment", "budgeting", "retirement", "taxes", "other"]
+CATALOG_COMPLEXITIES = ["beginner", "intermediate", "advanced"]
+CATALOG_TOOLS_PER_ENTRY = MAX_RESULTS  # Requests slice max_results from these
+CATALOG_CONCURRENCY = 2  # Cells generated at once; each fans out, so this leaves slots for live traffic
+CATALOG_REFRESH_HOUR_UTC = 3  # Off-peak hour for the daily refresh
+CATALOG_MAX_AGE = timedelta(hours=20)  # Skip the daily run if a recent refresh already happened
+CATALOG_RELOAD_SECONDS = 600  # How often a worker checks for a version built elsewhere
+CATALOG_VERSIONS_KEPT = 3
+CATALOG_CURRENT_KEY = "tool_catalog_current"
+CATALOG_LOCK_KEY = "tool_catalog_refresh_lock"
+CATALOG_LOCK_TTL = timedelta(hours=2)
+
+_catalog: Optional[dict] = None
+_catalog_loaded_at: Optional[datetime] = None
+_catalog_refresh: Optional[asyncio.Task] = None
+_catalog_scheduler: Optional[asyncio.Task] = None
+
+def get_catalog_key(version: int) -> str:
+    return f"tool_catalog_v{version}"
+
+def get_catalog_cell(category: str, complexity: str) -> str:
+    return f"{normalize_text(category)}|{normalize_text(complexity)}"
+
+async def load_tool_catalog() -> Optional[dict]:
+    """Return the current catalog, re-reading storage every CATALOG_RELOAD_SECONDS"""
+    global _catalog, _catalog_loaded_at
+    if _catalog_loaded_at and (datetime.now() - _catalog_loaded_at).total_seconds() < CATALOG_RELOAD_SECONDS:
+        return _catalog
+    
+    try:
+        current = await asyncio.to_thread(db.storage.json.get, CATALOG_CURRENT_KEY, default={})
+        version = current.get("version")
+        if version and (_catalog is None or _catalog["version"] != version):
+            _catalog = await asyncio.to_thread(db.storage.json.get, get_catalog_key(version))
+            print(f"Loaded tool catalog v{version} generated at {_catalog['generated_at']}")
+    except Exception as e:
+        print(f"Error loading tool catalog: {e}")
+    
+    _catalog_loaded_at = datetime.now()
+    return _catalog
+
+async def build_tool_catalog(categories: List[str], complexities: List[str]) -> None:
+    """Generate every category/complexity cell and publish the result as a new catalog version"""
+    global _catalog, _catalog_loaded_at
+    previous = await load_tool_catalog()
+    version = (previous["version"] if previous else 0) + 1
+    # Cells outside this run, or whose generation fails, carry over from the previous version
+    entries = dict(previous["entries"]) if previous else {}
+    semaphore = asyncio.Semaphore(CATALOG_CONCURRENCY)
+    
+    async def build_cell(category: str, complexity: str) -> None:
+        request = ToolGenerationRequest(
+            category=category,
+            complexity=complexity,
+            max_results=CATALOG_TOOLS_PER_ENTRY,
+            fan_out=True
+        )
+        async with semaphore:
+            try:
+                response = await run_generation(request)
+            except Exception as e:
+                print(f"Error generating catalog cell {category}/{complexity}: {e}")
+                return
+        # Stored once at build time, so compact catalog reads find embed_id already set
+        for tool in response.tools:
+            if tool.embed_code:
+                await store_tool_embed(tool)
+        entries[get_catalog_cell(category, complexity)] = json.loads(response.json())["tools"]
+        # Live /generate requests for the same cell get these tools too
+        await cache_tools(request, response)
+    
+    print(f"Building tool catalog v{version}: {len(categories)} categories x {len(complexities)} complexities")
+    await asyncio.gather(*[build_cell(category, complexity) for category in categories for complexity in complexities])
+    
+    catalog = {"version": version, "generated_at": datetime.now().isoformat(), "entries": entries}
+    await asyncio.to_thread(db.storage.json.put, get_catalog_key(version), catalog)
+    await asyncio.to_thread(db.storage.json.put, CATALOG_CURRENT_KEY, {"version": version, "generated_at": catalog["generated_at"]})
+    _catalog = catalog
+    _catalog_loaded_at = datetime.now()
+    print(f"Published tool catalog v{version} with {len(entries)} cells")
+    
+    stale_version = version - CATALOG_VERSIONS_KEPT
+    if stale_version > 0:
+        try:
+            await asyncio.to_thread(db.storage.json.delete, get_catalog_key(stale_version))
+        except Exception as e:
+            print(f"Error deleting tool catalog v{stale_version}: {e}")
+
+async def acquire_catalog_lock() -> bool:
+    """Best-effort guard against several workers building the catalog at once"""
+    try:
+        lock = await asyncio.to_thread(db.storage.json.get, CATALOG_LOCK_KEY, default={})
+        if lock.get("acquired_at") and datetime.now() - datetime.fromisoformat(lock["acquired_at"]) < CATALOG_LOCK_TTL:
+            return False
+        await asyncio.to_thread(db.storage.json.put, CATALOG_LOCK_KEY, {"acquired_at": datetime.now().isoformat()})
+    except Exception as e:
+        print(f"Error acquiring tool catalog lock: {e}")
+    return True
+
+async def refresh_tool_catalog(categories: List[str], complexities: List[str]) -> None:
+    try:
+        await build_tool_catalog(categories, complexities)
+    except Exception as e:
+        print(f"Error refreshing tool catalog: {e}")
+    finally:
+        try:
+            await asyncio.to_thread(db.storage.json.put, CATALOG_LOCK_KEY, {})
+        except Exception as e:
+            print(f"Error releasing tool catalog lock: {e}")
+
+async def start_catalog_refresh(categories: List[str], complexities: List[str]) -> bool:
+    """Start a background catalog build unless one is already running"""
+    global _catalog_refresh
+    if _catalog_refresh is not None and not _catalog_refresh.done():
+        return False
+    if not await acquire_catalog_lock():
+        return False
+    _catalog_refresh = asyncio.create_task(refresh_tool_catalog(categories, complexities))
+    return True
+
+def seconds_until_refresh_hour() -> float:
+    now = datetime.now(timezone.utc)
+    next_run = now.replace(hour=CATALOG_REFRESH_HOUR_UTC, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+async def catalog_scheduler_loop() -> None:
+    """Rebuild the catalog once a day at CATALOG_REFRESH_HOUR_UTC"""
+    while True:
+        await asyncio.sleep(seconds_until_refresh_hour())
+        catalog = await load_tool_catalog()
+        if catalog and datetime.now() - datetime.fromisoformat(catalog["generated_at"]) < CATALOG_MAX_AGE:
+            continue
+        await start_catalog_refresh(CATALOG_CATEGORIES, CATALOG_COMPLEXITIES)
+
+def ensure_catalog_scheduler() -> None:
+    global _catalog_scheduler
+    if _catalog_scheduler is None or _catalog_scheduler.done():
+        _catalog_scheduler = asyncio.create_task(catalog_scheduler_loop())
+
+def stop_catalog_scheduler() -> None:
+    global _catalog_scheduler
+    scheduler, _catalog_scheduler = _catalog_scheduler, None
+    if scheduler is not None:
+        scheduler.cancel()
+
+# Run the daily catalog scheduler for as long as the app is up. Both handlers are safe to
+# call more than once, since newer FastAPI versions run them once per enclosing router.
+router.add_event_handler("startup", ensure_catalog_scheduler)
+router.add_event_handler("shutdown", stop_catalog_scheduler)
+
+@router.get("/catalog/{category}/{complexity}", operation_id="get_tool_catalog")
+async def get_tool_catalog(category: str, complexity: str, max_results: int = 3, compact_embeds: bool = False) -> ToolCatalogResponse:
+    """
+    Pre-generated tools for a category and complexity, served from the current catalog.
+    Cells missing from the catalog, or with fewer than max_results tools, are generated live.
+    """
+    max_results = clamp_max_results(max_results)
+    catalog = await load_tool_catalog()
+    if catalog:
+        tools = catalog["entries"].get(get_catalog_cell(category, complexity)) or []
+        if len(tools) >= max_results:
+            return ToolCatalogResponse(
+                tools=await with_embed_refs([ToolSuggestion(**tool) for tool in tools[:max_results]], compact_embeds),
+                source="catalog",
+                version=catalog["version"],
+                generated_at=catalog["generated_at"]
+            )
+    
+    response = await generate_tool_ideas(ToolGenerationRequest(
+        category=category,
+        complexity=complexity,
+        max_results=max_results,
+        compact_embeds=compact_embeds
+    ))
+    return ToolCatalogResponse(tools=response.tools, source="live")
+
+@router.post("/catalog/refresh", operation_id="refresh_tool_catalog")
+async def refresh_tool_catalog_endpoint(request: CatalogRefreshRequest, user: AdminUser) -> CatalogRefreshResponse:
+    """Start a catalog build now instead of waiting for the daily off-peak run (admins only)"""
+    categories = request.categories or CATALOG_CATEGORIES
+    complexities = request.complexities or CATALOG_COMPLEXITIES
+    if not await start_catalog_refresh(categories, complexities):
+        return CatalogRefreshResponse(started=False, detail="A catalog refresh is already running")
+    
+    return CatalogRefreshResponse(
+        started=True,
+        detail=f"Building {len(categories) * len(complexities)} catalog cells in the background"
+    )
+
+@router.get("/generate/backend-stats", operation_id="tool_generation_backend_stats")
+def get_backend_stats(user: AdminUser) -> Dict[str, Any]:
+    """Per-backend latency histograms, hedging counters and the current hedge budget (admins only)"""
+    return {
+        "hedging": {**hedge_stats, "enabled": HEDGE_ENABLED, "budget_seconds": get_hedge_budget()},
+        "latency": {
+            backend: {
+                "first_token": get_latency_histogram(f"tool_generator_first_token_{backend}").stats(),
+                "total": get_latency_histogram(f"tool_generator_total_{backend}").stats()
+            }
+            for backend in (BACKEND_AZURE, BACKEND_OPENAI)
+        }
+    }
@@ -1,3 +1,4 @@
+from .admin import AdminUser
 from .user import AuthorizedUser, User
 
-__all__ = ["AuthorizedUser", "User"]
+__all__ = ["AdminUser", "AuthorizedUser", "User"]
@@ -0,0 +1,40 @@
+"""Fastapi dependency that only lets through users listed as admins.
+
+Admins are listed by user ID (the token subject) in the comma-separated
+ADMIN_USER_IDS secret. Without the secret, or if it can't be read, nobody
+is an admin.
+
+Usage:
+
+    from app.auth import AdminUser
+
+    @router.post("/maintenance")
+    def run_maintenance(user: AdminUser):
+        return start_maintenance(requested_by=user.sub)
+"""
+
+from http import HTTPStatus
+from typing import Annotated
+
+import databutton as db
+from fastapi import Depends, HTTPException
+
+from databutton_app.mw.auth_mw import get_authorized_user, User
+
+
+def get_admin_user_ids() -> set[str]:
+    try:
+        admin_user_ids = db.secrets.get("ADMIN_USER_IDS") or ""
+    except Exception as e:
+        print(f"Error reading ADMIN_USER_IDS: {e}")
+        return set()
+    return {user_id.strip() for user_id in admin_user_ids.split(",") if user_id.strip()}
+
+
+def get_admin_user(user: Annotated[User, Depends(get_authorized_user)]) -> User:
+    if user.sub not in get_admin_user_ids():
+        raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail="Admin access required")
+    return user
+
+
+AdminUser = Annotated[User, Depends(get_admin_user)]
@@ -0,0 +1,139 @@
+"""Shared async client for the DataForSEO API.
+
+One pooled HTTP/2 client is built lazily per process and reused by every
+keyword endpoint, so TLS connections stay alive between lookups and a single
+worker can keep many requests in flight without holding threads.
+
+Usage:
+
+    from app.libs.dataforseo_client import SEARCH_VOLUME_PATH, dataforseo_post
+
+    response = await dataforseo_post(SEARCH_VOLUME_PATH, [{"keywords": ["budget template"]}])
+    if response.status_code == 200:
+        result = response.json()
+
+Routers that use the client register close_dataforseo_client as a shutdown
+handler, so the pool is closed when the app shuts down:
+
+    router = APIRouter(on_shutdown=[close_dataforseo_client])
+"""
+
+import asyncio
+import base64
+from typing import Iterator, TypeVar
+
+import databutton as db
+import httpx
+from fastapi import HTTPException
+
+DATAFORSEO_BASE_URL = "https://api.dataforseo.com/v3/"
+
+# Endpoint paths relative to DATAFORSEO_BASE_URL
+KEYWORDS_FOR_KEYWORDS_PATH = "keywords_data/google_ads/keywords_for_keywords/live"
+SEARCH_VOLUME_PATH = "keywords_data/google/search_volume/live"
+
+# Per-task status_code of a task that completed
+TASK_OK_STATUS_CODE = 20000
+
+# Payload limits. Live endpoints run one task per POST, and a search_volume
+# task takes up to 1000 keywords, so batches are packed into task keywords.
+LIVE_MAX_TASKS_PER_POST = 1
+SEARCH_VOLUME_MAX_KEYWORDS = 1000
+
+# Connection pool sizing. All traffic goes to a single host, so these are per-host limits.
+MAX_CONNECTIONS = 30
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60  # seconds an idle connection is kept open
+
+# Requests in flight at once. HTTP/2 multiplexes streams over few connections,
+# so the pool limits alone do not cap concurrency against DataForSEO's rate limits.
+MAX_CONCURRENT_REQUESTS = 30
+
+REQUEST_TIMEOUT = 60  # seconds, same budget the blocking calls used
+
+T = TypeVar("T")
+
+_client: httpx.AsyncClient | None = None
+_semaphore: asyncio.Semaphore | None = None
+
+
+def get_dataforseo_headers() -> dict:
+    """Build the basic auth headers from the DataForSEO secrets"""
+    username = db.secrets.get("DATAFORSEO_USERNAME")
+    password = db.secrets.get("DATAFORSEO_PASSWORD")
+
+    if not username or not password:
+        raise HTTPException(status_code=500, detail="DataForSEO API credentials not configured")
+
+    return {
+        "Authorization": f"Basic {base64.b64encode(f'{username}:{password}'.encode()).decode()}",
+        "Content-Type": "application/json"
+    }
+
+
+def get_dataforseo_client() -> httpx.AsyncClient:
+    """Return the process-wide DataForSEO client, creating it on first use"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=DATAFORSEO_BASE_URL,
+            headers=get_dataforseo_headers(),
+            http2=True,
+            timeout=httpx.Timeout(REQUEST_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            )
+        )
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _semaphore
+
+
+async def dataforseo_post(path: str, payload: list) -> httpx.Response:
+    """POST a task array to a DataForSEO endpoint through the shared pool
+
+    Args:
+        path: Endpoint path relative to DATAFORSEO_BASE_URL
+        payload: List of task objects
+
+    Returns:
+        The raw response; callers check the status code as before
+    """
+    client = get_dataforseo_client()
+    async with _get_semaphore():
+        return await client.post(path, json=payload)
+
+
+def get_task_keywords(result: dict, index: int = 0) -> list:
+    """Extract the keyword items of one task from a DataForSEO response"""
+    tasks = result.get("tasks") or []
+    if len(tasks) > index and tasks[index].get("result") and len(tasks[index]["result"]) > 0:
+        return tasks[index]["result"][0].get("keywords", []) or []
+    return []
+
+
+def task_succeeded(result: dict, index: int = 0) -> bool:
+    """Whether one task of a DataForSEO response completed; a 200 response can still carry failed tasks"""
+    tasks = result.get("tasks") or []
+    return len(tasks) > index and tasks[index].get("status_code") == TASK_OK_STATUS_CODE
+
+
+def chunked(items: list[T], size: int) -> Iterator[list[T]]:
+    """Split items into lists of at most size elements"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def close_dataforseo_client() -> None:
+    """Close the shared client and its pooled connections. Safe to call more than once."""
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,237 @@
+"""Index of recently seen IDs for idempotent processing of redelivered events.
+
+Each ID moves through two states: claimed when it is first received and done
+once it has been processed. States are kept in memory and persisted as one
+db.storage.json key per ID, so they survive restarts and are shared between
+instances. Entries older than the TTL count as unseen.
+
+Storage has no compare-and-set, so a claim writes an owner token, waits
+claim_settle_seconds for competing writes to land and reads it back. That
+wait blocks the calling thread on every first delivery, so it adds directly
+to the caller's response time; lower it where storage writes land faster.
+A claim can also outlive the work it guarded, if the process died between
+claiming and persisting that work; given has_work, a claim older than a
+grace period whose work doesn't exist counts as unseen.
+
+IDs written since the last flush are buffered in memory, and a background
+thread writes them every FLUSH_INTERVAL seconds (and at exit) as a new,
+immutable chunk key named by the flush time. The same thread deletes chunks
+older than the TTL together with the entries they list, so ID keys don't
+accumulate.
+
+Usage:
+
+    from app.libs.dedupe_index import DedupeIndex
+
+    seen = DedupeIndex("stripe_events", ttl_seconds=7 * 24 * 3600)
+    if seen.claim(event_id, has_work=jobs.exists):
+        ...  # first delivery: queue it
+    if not seen.is_done(event_id):
+        ...  # apply side effects
+        seen.mark_done(event_id)
+"""
+
+import atexit
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+import databutton as db
+
+from app.libs.lru_cache import LRUCache
+
+STATE_CLAIMED = "claimed"
+STATE_DONE = "done"
+
+# How long a claim may go without its work being persisted before it counts as abandoned
+CLAIM_GRACE_SECONDS = 60
+CLAIM_SETTLE_SECONDS = 0.5
+FLUSH_INTERVAL = 60
+SWEEP_INTERVAL = 3600
+
+# Chunk keys are "{name}_expiry_{flushed_at}_{owner}_{sequence}"
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+
+class DedupeIndex:
+    """Claimed/done states per ID, in memory with persistent backing"""
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float,
+        max_entries: int = 20000,
+        claim_settle_seconds: float = CLAIM_SETTLE_SECONDS,
+    ):
+        self.name = name
+        self._ttl = ttl_seconds
+        self._claim_settle = claim_settle_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._cache = LRUCache(max_entries=max_entries, max_bytes=16 * 1024 * 1024, ttl_seconds=ttl_seconds)
+        self._owner = uuid.uuid4().hex
+        # IDs written since the last flush, for the next expiry chunk
+        self._pending_ids: set[str] = set()
+        self._sequence = 0
+        self._flusher: Optional[threading.Thread] = None
+        self.duplicates = 0
+        self.reclaimed = 0
+
+    def _key(self, item_id: str) -> str:
+        return f"{self.name}_{re.sub(r'[^A-Za-z0-9_.-]', '_', item_id)}"
+
+    @property
+    def _chunk_prefix(self) -> str:
+        return f"{self.name}_expiry_"
+
+    def claim(self, item_id: str, has_work: Optional[Callable[[str], bool]] = None) -> bool:
+        """
+        Record item_id as received; False if it was already claimed or done. With has_work,
+        a claim older than CLAIM_GRACE_SECONDS is only honoured if has_work(item_id) is true.
+        """
+        with self._lock:
+            # Checked and set under the lock, so concurrent deliveries here can't both claim
+            if self._cache.get(item_id) is not None:
+                self.duplicates += 1
+                return False
+            self._cache.set(item_id, STATE_CLAIMED)
+
+        entry = self._load_entry(item_id)
+        if entry is not None:
+            if entry["state"] == STATE_CLAIMED and has_work is not None and self._abandoned(item_id, entry, has_work):
+                print(f"Reclaiming abandoned {self.name} entry {item_id}")
+                self.reclaimed += 1
+            else:
+                self._cache.set(item_id, entry["state"])
+                self.duplicates += 1
+                return False
+
+        self._store(item_id, STATE_CLAIMED)
+        time.sleep(self._claim_settle)
+        entry = self._load_entry(item_id)
+        if entry is not None and entry.get("owner") not in (None, self._owner):
+            # Another instance claimed it at the same time and its write landed last
+            self.duplicates += 1
+            return False
+        return True
+
+    def release(self, item_id: str) -> None:
+        """Forget a claim whose processing could not be started, so a redelivery is accepted"""
+        self._cache.delete(item_id)
+        try:
+            db.storage.json.delete(self._key(item_id))
+        except Exception as e:
+            print(f"Error releasing {self.name} entry {item_id}: {e}")
+
+    def is_done(self, item_id: str) -> bool:
+        if self._cache.get(item_id) == STATE_DONE:
+            return True
+        # Another instance may have finished it since it was claimed here
+        state = self._load(item_id)
+        if state is not None:
+            self._cache.set(item_id, state)
+        return state == STATE_DONE
+
+    def mark_done(self, item_id: str) -> None:
+        self._cache.set(item_id, STATE_DONE)
+        self._store(item_id, STATE_DONE)
+
+    def flush(self) -> None:
+        """Write the IDs stored since the last flush as a new expiry chunk"""
+        with self._flush_lock:
+            with self._lock:
+                item_ids, self._pending_ids = self._pending_ids, set()
+            if not item_ids:
+                return
+            self._sequence += 1
+            chunk_key = f"{self._chunk_prefix}{datetime.now().strftime(TIMESTAMP_FORMAT)}_{self._owner[:8]}_{self._sequence}"
+            try:
+                db.storage.json.put(chunk_key, {"ids": sorted(item_ids)})
+            except Exception as e:
+                print(f"Error writing {self.name} expiry chunk: {e}")
+                with self._lock:
+                    self._pending_ids |= item_ids
+
+    def stats(self) -> dict:
+        return {"duplicates": self.duplicates, "reclaimed": self.reclaimed, **self._cache.stats()}
+
+    def _abandoned(self, item_id: str, entry: dict, has_work: Callable[[str], bool]) -> bool:
+        if time.time() - entry.get("at", 0) < CLAIM_GRACE_SECONDS:
+            return False
+        try:
+            return not has_work(item_id)
+        except Exception as e:
+            print(f"Error checking work for {self.name} entry {item_id}: {e}")
+            return False
+
+    def _load(self, item_id: str) -> Optional[str]:
+        entry = self._load_entry(item_id)
+        return entry["state"] if entry else None
+
+    def _load_entry(self, item_id: str) -> Optional[dict]:
+        try:
+            entry = db.storage.json.get(self._key(item_id), default={})
+        except Exception:
+            return None
+        if not entry.get("state") or time.time() - entry.get("at", 0) > self._ttl:
+            return None
+        return entry
+
+    def _store(self, item_id: str, state: str) -> None:
+        try:
+            db.storage.json.put(self._key(item_id), {"state": state, "at": time.time(), "owner": self._owner})
+        except Exception as e:
+            # The in-memory entry still dedupes deliveries to this instance
+            print(f"Error storing {self.name} entry {item_id}: {e}")
+            return
+        with self._lock:
+            self._pending_ids.add(item_id)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name=f"{self.name}_flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_loop(self) -> None:
+        last_sweep = None
+        while True:
+            try:
+                if last_sweep is None or time.monotonic() - last_sweep >= SWEEP_INTERVAL:
+                    last_sweep = time.monotonic()
+                    self._delete_expired()
+            except Exception as e:
+                print(f"Error sweeping {self.name} entries: {e}")
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def _delete_expired(self) -> None:
+        # A chunk is written after every entry it lists, so once it is older than the TTL
+        # they are too. Every instance sweeps, and deleting a key another instance already
+        # removed just fails.
+        cutoff = (datetime.now() - timedelta(seconds=self._ttl)).strftime(TIMESTAMP_FORMAT)
+        chunk_keys = [
+            file.name for file in db.storage.json.list()
+            if file.name.startswith(self._chunk_prefix) and file.name[len(self._chunk_prefix):].split("_")[0] < cutoff
+        ]
+        for chunk_key in chunk_keys:
+            try:
+                item_ids = db.storage.json.get(chunk_key, default={}).get("ids", [])
+            except Exception as e:
+                print(f"Error reading {self.name} expiry chunk {chunk_key}: {e}")
+                continue
+            for item_id in item_ids:
+                # The ID may have been written again since and listed in a newer chunk
+                entry = db.storage.json.get(self._key(item_id), default={})
+                if entry and time.time() - entry.get("at", 0) <= self._ttl:
+                    continue
+                try:
+                    db.storage.json.delete(self._key(item_id))
+                except Exception:
+                    pass
+            try:
+                db.storage.json.delete(chunk_key)
+            except Exception:
+                pass
+            print(f"Deleted {len(item_ids)} expired {self.name} entries from {chunk_key}")
@@ -0,0 +1,143 @@
+"""Content-addressed storage for generated embed code.
+
+An embed is stored once under the hash of its HTML. Its inline <style> and
+<script> blocks are split out as separate assets, also addressed by content
+hash, so styles and scripts shared by many tools are stored (and cached by
+browsers) once. The remaining template keeps the original tags around a
+marker, so the HTML can be reassembled exactly or served with the assets
+linked.
+
+Usage:
+
+    from app.libs.embed_store import load_embed, render_embed, store_embed
+
+    embed_id = await store_embed(tool.embed_code)
+    document = await load_embed(embed_id)
+    html = await render_embed(document, inline=True)
+"""
+
+import asyncio
+import hashlib
+import re
+from typing import Optional
+
+import databutton as db
+
+from app.libs.lru_cache import LRUCache
+
+EMBED_KEY_PREFIX = "embed_doc_"
+ASSET_KEY_PREFIX = "embed_asset_"
+
+# Asset type by tag: file extension and media type
+ASSET_TYPES = {
+    "style": ("css", "text/css"),
+    "script": ("js", "application/javascript"),
+}
+
+# Inline blocks only; <script src=...> is left in the template as is
+_BLOCK_PATTERN = re.compile(
+    r"(<(style|script)\b(?![^>]*\bsrc\s*=)[^>]*>)(.*?)(</\2\s*>)",
+    re.IGNORECASE | re.DOTALL,
+)
+_MARKER_PATTERN = re.compile(r"<!--embed-asset:([0-9a-f]+)-->")
+_LINKED_PATTERN = re.compile(
+    r"<(style|script)\b[^>]*><!--embed-asset:([0-9a-f]+)--></\1\s*>",
+    re.IGNORECASE,
+)
+
+# Entries never change once written, so the TTL only bounds staleness after a storage wipe
+_cache = LRUCache(max_entries=2000, max_bytes=50 * 1024 * 1024, ttl_seconds=24 * 3600)
+
+
+def content_id(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+def split_embed(html: str) -> tuple[dict, list[dict]]:
+    """Split inline style/script blocks out of html into assets"""
+    assets = {}
+
+    def extract(match: re.Match) -> str:
+        open_tag, tag, content, close_tag = match.groups()
+        if not content.strip():
+            return match.group(0)
+        asset_id = content_id(content)
+        assets[asset_id] = {"id": asset_id, "type": tag.lower(), "content": content}
+        return f"{open_tag}<!--embed-asset:{asset_id}-->{close_tag}"
+
+    template = _BLOCK_PATTERN.sub(extract, html)
+    document = {
+        "template": template,
+        "assets": [{"id": asset["id"], "type": asset["type"]} for asset in assets.values()],
+    }
+    return document, list(assets.values())
+
+
+async def store_embed(html: str) -> str:
+    """Store html and its assets if not already stored, and return its embed ID"""
+    embed_id = content_id(html)
+    if _cache.get(EMBED_KEY_PREFIX + embed_id) is not None:
+        return embed_id
+
+    document, assets = split_embed(html)
+    for asset in assets:
+        key = ASSET_KEY_PREFIX + asset["id"]
+        if _cache.get(key) is None:
+            await asyncio.to_thread(db.storage.text.put, key, asset["content"])
+            _cache.set(key, asset["content"])
+
+    await asyncio.to_thread(db.storage.json.put, EMBED_KEY_PREFIX + embed_id, document)
+    _cache.set(EMBED_KEY_PREFIX + embed_id, document)
+    return embed_id
+
+
+async def load_embed(embed_id: str) -> Optional[dict]:
+    """Return the stored template and asset list for embed_id, or None"""
+    key = EMBED_KEY_PREFIX + embed_id
+    document = _cache.get(key)
+    if document is None:
+        try:
+            document = await asyncio.to_thread(db.storage.json.get, key)
+        except Exception:
+            return None
+        _cache.set(key, document)
+    return document
+
+
+async def load_asset(asset_id: str) -> Optional[str]:
+    """Return the content of an asset, or None"""
+    key = ASSET_KEY_PREFIX + asset_id
+    content = _cache.get(key)
+    if content is None:
+        try:
+            content = await asyncio.to_thread(db.storage.text.get, key)
+        except Exception:
+            return None
+        _cache.set(key, content)
+    return content
+
+
+def asset_filename(asset: dict) -> str:
+    return f"{asset['id']}.{ASSET_TYPES[asset['type']][0]}"
+
+
+async def render_embed(document: dict, inline: bool = True, asset_base_url: str = "assets/") -> str:
+    """
+    Rebuild the embed HTML. Inline puts the assets back where they came from, giving the
+    original HTML; otherwise each block becomes a <link>/<script src> under asset_base_url.
+    """
+    if not inline:
+        types = {asset["id"]: asset for asset in document["assets"]}
+
+        def link(match: re.Match) -> str:
+            url = asset_base_url + asset_filename(types[match.group(2)])
+            if match.group(1).lower() == "style":
+                return f'<link rel="stylesheet" href="{url}">'
+            return f'<script src="{url}"></script>'
+
+        return _LINKED_PATTERN.sub(link, document["template"])
+
+    contents = {}
+    for asset in document["assets"]:
+        contents[asset["id"]] = await load_asset(asset["id"]) or ""
+    return _MARKER_PATTERN.sub(lambda match: contents.get(match.group(1), ""), document["template"])
@@ -0,0 +1,190 @@
+"""Append-only event log stored as immutable NDJSON segments in db.storage.text.
+
+Appends are buffered in memory and written by a background thread every
+flush_interval seconds (and at exit), each flush as one or more new segments.
+A segment is written once and never rewritten, and its key carries the flush
+time, the writing process and a sequence number, so no two processes ever
+write the same key and no shared index is needed: readers find segments by
+listing storage. Segments past the retention window are deleted by the flush
+thread about once an hour.
+
+Usage:
+
+    from app.libs.event_log import SegmentedEventLog
+
+    log = SegmentedEventLog("stripe_webhook_events")
+    log.append({"id": "evt_123", "type": "invoice.paid"})
+    events, next_cursor = log.read(limit=50)  # newest first
+    older, next_cursor = log.read(cursor=next_cursor, limit=50)
+"""
+
+import atexit
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+import databutton as db
+
+# Segment keys are "{name}_{flushed_at}_{instance}_{sequence}"
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S%f"
+
+CLEANUP_INTERVAL = 3600
+
+
+class SegmentedEventLog:
+    """Append-only NDJSON log written as buffered, immutable segments"""
+
+    def __init__(
+        self,
+        name: str,
+        flush_interval: float = 30.0,
+        max_segment_entries: int = 500,
+        max_segment_bytes: int = 512 * 1024,
+        max_buffered_entries: int = 10000,
+        retention: timedelta = timedelta(days=14),
+        max_segments: int = 50000,
+    ):
+        self.name = name
+        self._flush_interval = flush_interval
+        self._max_entries = max_segment_entries
+        self._max_bytes = max_segment_bytes
+        self._max_buffered = max_buffered_entries
+        self._retention = retention
+        self._max_segments = max_segments
+        self._instance = uuid.uuid4().hex[:8]
+        self._key_pattern = re.compile(rf"{re.escape(name)}_(\d{{20}})_([0-9a-f]{{8}})_(\d+)")
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer: list[str] = []
+        self._sequence = 0
+        self._flusher: Optional[threading.Thread] = None
+        self._last_cleanup = 0.0
+
+    def append(self, entry: dict) -> None:
+        """Buffer an entry; it is written with the next flush"""
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) > self._max_buffered:
+                # Storage has been failing for a while; keep the newest entries
+                dropped = len(self._buffer) - self._max_buffered
+                del self._buffer[:dropped]
+                print(f"Dropped {dropped} buffered {self.name} entries")
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name=f"{self.name}_flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def flush(self) -> None:
+        """Write buffered entries as new segments; entries that fail to write stay buffered"""
+        with self._flush_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+            written = 0
+            try:
+                for segment_lines in self._pack(lines):
+                    db.storage.text.put(self._next_key(), "\n".join(segment_lines) + "\n")
+                    written += len(segment_lines)
+            except Exception as e:
+                print(f"Error flushing {self.name} entries: {e}")
+                with self._lock:
+                    self._buffer[:0] = lines[written:]
+
+    def read(self, cursor: Optional[str] = None, limit: int = 50) -> tuple[list[dict], Optional[str]]:
+        """
+        Return up to limit entries, newest first, and a cursor for the next page (None at the end).
+        Raises ValueError for a malformed cursor.
+        """
+        # So this process's own recent entries show up right away
+        self.flush()
+        keys = self._segment_keys()
+
+        index, end = 0, None
+        if cursor:
+            key, _, position = cursor.rpartition(":")
+            if not key or (position and not position.isdigit()):
+                raise ValueError(f"Invalid cursor: {cursor}")
+            if key not in keys:
+                # The segment has passed retention since the previous page
+                return [], None
+            # An empty position means the whole segment
+            index, end = keys.index(key), int(position) if position else None
+
+        events = []
+        while index < len(keys):
+            lines = self._segment_lines(keys[index])
+            end = len(lines) if end is None else min(end, len(lines))
+            start = max(end - (limit - len(events)), 0)
+            for line in reversed(lines[start:end]):
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+
+            if len(events) >= limit:
+                if start > 0:
+                    return events, f"{keys[index]}:{start}"
+                return events, f"{keys[index + 1]}:" if index + 1 < len(keys) else None
+            index, end = index + 1, None
+
+        return events, None
+
+    def _pack(self, lines: list[str]) -> list[list[str]]:
+        segments, current, size = [], [], 0
+        for line in lines:
+            if current and (len(current) >= self._max_entries or size + len(line) > self._max_bytes):
+                segments.append(current)
+                current, size = [], 0
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            segments.append(current)
+        return segments
+
+    def _next_key(self) -> str:
+        self._sequence += 1
+        return f"{self.name}_{datetime.now().strftime(TIMESTAMP_FORMAT)}_{self._instance}_{self._sequence}"
+
+    def _segment_keys(self) -> list[str]:
+        """Segment keys, newest first"""
+        try:
+            files = db.storage.text.list()
+        except Exception as e:
+            print(f"Error listing {self.name} segments: {e}")
+            return []
+        matches = [match for match in map(self._key_pattern.fullmatch, (file.name for file in files)) if match]
+        matches.sort(key=lambda match: (match[1], match[2], int(match[3])), reverse=True)
+        return [match[0] for match in matches]
+
+    def _segment_lines(self, key: str) -> list[str]:
+        try:
+            text = db.storage.text.get(key)
+        except Exception:
+            return []
+        return [line for line in text.split("\n") if line]
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self._flush_interval)
+            self.flush()
+            if time.monotonic() - self._last_cleanup >= CLEANUP_INTERVAL:
+                self._last_cleanup = time.monotonic()
+                self._delete_expired()
+
+    def _delete_expired(self) -> None:
+        # Every process runs this; deleting a segment another process already removed just fails
+        keys = self._segment_keys()
+        cutoff = (datetime.now() - self._retention).strftime(TIMESTAMP_FORMAT)
+        expired = keys[self._max_segments:] + [
+            key for key in keys[:self._max_segments]
+            if self._key_pattern.fullmatch(key)[1] < cutoff
+        ]
+        for key in expired:
+            try:
+                db.storage.text.delete(key)
+            except Exception as e:
+                print(f"Error deleting {self.name} segment {key}: {e}")
@@ -0,0 +1,91 @@
+"""Incremental parser that yields array elements of a streamed JSON document.
+
+Completions stream a document like {"tools": [{...}, {...}]} a few tokens at
+a time. The parser tracks string and nesting state across chunks and returns
+each object element as soon as its closing brace arrives, for arrays that are
+either the document root or a direct value of the root object.
+
+Usage:
+
+    from app.libs.incremental_json import JsonArrayStreamParser
+
+    parser = JsonArrayStreamParser()
+    async for text in token_stream:
+        for item in parser.feed(text):
+            handle(item)
+    full_text = parser.text
+"""
+
+import json
+
+
+class JsonArrayStreamParser:
+    """Feed JSON text in chunks and collect completed array element objects"""
+
+    def __init__(self):
+        self._chunks: list[str] = []
+        self._buffer = ""
+        self._position = 0
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._element_start: int | None = None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> list[dict]:
+        """Consume a chunk and return the elements it completed, in order"""
+        self._chunks.append(chunk)
+        self._buffer += chunk
+        completed = []
+
+        for index in range(self._position, len(self._buffer)):
+            char = self._buffer[index]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "{" and self._element_start is None and self._is_element_position():
+                    self._element_start = index
+                self._stack.append(char)
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if char == "}" and self._element_start is not None and self._is_element_position():
+                    element = self._buffer[self._element_start:index + 1]
+                    self._element_start = None
+                    try:
+                        item = json.loads(element)
+                    except json.JSONDecodeError:
+                        item = None
+                    if isinstance(item, dict):
+                        completed.append(item)
+
+        self._position = len(self._buffer)
+
+        # Text before an open element is no longer needed
+        if self._element_start is None:
+            self._buffer = ""
+            self._position = 0
+        elif self._element_start > 0:
+            self._buffer = self._buffer[self._element_start:]
+            self._position -= self._element_start
+            self._element_start = 0
+
+        return completed
+
+    def _is_element_position(self) -> bool:
+        # Directly inside a root array, or inside an array that is a value of the root object
+        return self._stack == ["["] or self._stack == ["{", "["]
@@ -0,0 +1,386 @@
+"""Persistent background job queue with a bounded pool of async workers.
+
+Jobs are stored in db.storage.json, one key per job. Workers start lazily
+on first use in the running event loop. The process that queues a job holds
+a lease on it, one key per unfinished job, renewed by a heartbeat until the
+job finishes. A periodic sweep on every instance lists the lease keys and
+takes over jobs whose lease has lapsed (their process died). No key is shared
+between jobs, so instances never overwrite each other's bookkeeping.
+
+Lease, dead-letter and expiry keys live under a jobqueue_{name}_ prefix, apart
+from the job records. Storage can only list every key, so each sweep lists
+once and filters on that prefix, and sweeps run a few lease periods apart:
+an abandoned job waits at most lease_seconds * (1 + SWEEP_LEASES) to be
+taken over.
+
+Usage:
+
+    from app.libs.job_queue import JobQueue
+
+    async def handle(payload: dict) -> dict:
+        return {"answer": 42}
+
+    jobs = JobQueue("my_jobs", handle, workers=4)
+    job = await jobs.submit({"question": "..."})
+    job = await jobs.get(job["id"])  # status: queued, running, completed or failed
+
+With dead_letter=True, jobs that fail every attempt are also listed by
+dead_letters() and can be put back on the queue with retry(). Failed attempts
+are retried after a backoff without holding a worker. With
+keep_completed=False, records of completed jobs are deleted instead of kept
+for polling; with finished_ttl_seconds, finished records are kept that long
+and then deleted by the sweep (dead-lettered jobs stay until retried).
+Records carry the owner passed to submit(), for callers that scope reads to
+the submitter.
+"""
+
+import asyncio
+import math
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable
+
+import databutton as db
+from fastapi import HTTPException
+
+from app.libs.lru_cache import LRUCache
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+TERMINAL_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+# Leases on queued and running jobs are renewed HEARTBEATS_PER_LEASE times per lease
+# period, so a holder that misses a few heartbeats loses its jobs. The sweep for
+# lapsed leases runs every SWEEP_LEASES lease periods.
+HEARTBEATS_PER_LEASE = 3
+SWEEP_LEASES = 5
+# How often finished records past their TTL are deleted
+CLEANUP_INTERVAL = 3600
+# Storage has no compare-and-set, so a claim waits for competing writes before reading back
+CLAIM_SETTLE_SECONDS = 1.0
+
+
+class JobQueue:
+    """Runs handler(payload) for submitted jobs on a fixed number of worker tasks"""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[dict], Awaitable[dict]],
+        workers: int = 4,
+        max_attempts: int = 1,
+        retry_delay_seconds: float = 5.0,
+        dead_letter: bool = False,
+        keep_completed: bool = True,
+        finished_ttl_seconds: float | None = None,
+        lease_seconds: float = 60.0,
+    ):
+        self.name = name
+        self._handler = handler
+        self._worker_count = workers
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay_seconds
+        self._dead_letter = dead_letter
+        self._keep_completed = keep_completed
+        self._finished_ttl = finished_ttl_seconds
+        self._lease_seconds = lease_seconds
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._maintainer: asyncio.Task | None = None
+        self._lease_lock: asyncio.Lock | None = None
+        self._instance = uuid.uuid4().hex
+        # Jobs this process has queued or is running, and holds the lease on
+        self._held: set[str] = set()
+        # Recently finished jobs, so polling doesn't hit storage for them. Jobs still
+        # in progress are always read from storage, since another instance may run them.
+        self._recent = LRUCache(max_entries=1000, max_bytes=50 * 1024 * 1024, ttl_seconds=3600)
+        self.processed = 0
+        self.failed = 0
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.name}_job_{job_id}"
+
+    @property
+    def _bookkeeping_prefix(self) -> str:
+        return f"jobqueue_{self.name}_"
+
+    @property
+    def _lease_prefix(self) -> str:
+        return f"{self._bookkeeping_prefix}lease_"
+
+    def _lease_key(self, job_id: str) -> str:
+        return self._lease_prefix + job_id
+
+    @property
+    def _dead_letter_prefix(self) -> str:
+        return f"{self._bookkeeping_prefix}deadletter_"
+
+    def _dead_letter_key(self, job_id: str) -> str:
+        return self._dead_letter_prefix + job_id
+
+    @property
+    def _expiry_prefix(self) -> str:
+        return f"{self._bookkeeping_prefix}expiry_"
+
+    def _expiry_key(self, job_id: str, expires_at: float) -> str:
+        # The expiry time is in the key, so the cleanup sweep only reads records that are due
+        return f"{self._expiry_prefix}{math.ceil(expires_at)}_{job_id}"
+
+    async def submit(self, payload: dict, job_id: str | None = None, owner: str | None = None) -> dict:
+        """Persist a new job and queue it, returning the job record"""
+        self._ensure_workers()
+        now = datetime.now().isoformat()
+        job = {
+            "id": job_id or uuid.uuid4().hex,
+            "status": JOB_QUEUED,
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "owner": owner,
+            "expires_at": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self._save(job)
+        await self._hold(job["id"])
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def get(self, job_id: str) -> dict | None:
+        """Return the job record, or None if there is no such job or it is past its TTL"""
+        self._ensure_workers()
+        job = self._recent.get(job_id)
+        if job is None:
+            try:
+                job = await asyncio.to_thread(db.storage.json.get, self._job_key(job_id))
+            except Exception:
+                return None
+            if job and job["status"] in TERMINAL_STATUSES:
+                self._recent.set(job_id, job)
+        if not job or (job.get("expires_at") is not None and job["expires_at"] <= time.time()):
+            # Expired records are deleted by the next cleanup sweep
+            return None
+        return job
+
+    def exists(self, job_id: str) -> bool:
+        """Whether a record is stored for job_id. Blocking, for code running off the event loop."""
+        if self._recent.get(job_id) is not None:
+            return True
+        return bool(db.storage.json.get(self._job_key(job_id), default={}))
+
+    async def dead_letters(self) -> list[dict]:
+        """Jobs that failed every attempt and haven't been retried since"""
+        job_ids = self._ids(await self._list_bookkeeping_keys(), self._dead_letter_prefix)
+        jobs = [await self.get(job_id) for job_id in job_ids]
+        return [job for job in jobs if job and job["status"] == JOB_FAILED]
+
+    async def retry(self, job_id: str) -> dict | None:
+        """Queue a failed job again with a fresh set of attempts; None if it isn't a failed job"""
+        self._ensure_workers()
+        job = await self.get(job_id)
+        if job is None or job["status"] != JOB_FAILED:
+            return None
+        # A copy, since get() may have returned the record cached for pollers
+        job = dict(job, status=JOB_QUEUED, attempts=0, error=None, expires_at=None)
+        await self._save(job)
+        await self._hold(job_id)
+        try:
+            await asyncio.to_thread(db.storage.json.delete, self._dead_letter_key(job_id))
+        except Exception:
+            pass
+        self._queue.put_nowait(job_id)
+        return job
+
+    def stats(self) -> dict:
+        return {
+            "workers": len([w for w in self._workers if not w.done()]),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "held": len(self._held),
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    def _ensure_workers(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._lease_lock = asyncio.Lock()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._worker_count)]
+        self._maintainer = asyncio.create_task(self._maintain())
+
+    async def _maintain(self) -> None:
+        # Heartbeat for held leases, plus a sweep for jobs whose holder went away. The
+        # sweep's one listing also finds finished jobs due for deletion.
+        last_sweep = last_cleanup = None
+        while True:
+            try:
+                if last_sweep is None or time.monotonic() - last_sweep >= self._lease_seconds * SWEEP_LEASES:
+                    last_sweep = time.monotonic()
+                    keys = await self._list_bookkeeping_keys()
+                    await self._requeue_expired(self._ids(keys, self._lease_prefix))
+                    if self._finished_ttl is not None and (last_cleanup is None or time.monotonic() - last_cleanup >= CLEANUP_INTERVAL):
+                        last_cleanup = time.monotonic()
+                        await self._delete_finished(self._ids(keys, self._expiry_prefix))
+                await self._renew_leases()
+            except Exception as e:
+                print(f"Error maintaining {self.name} leases: {e}")
+            await asyncio.sleep(self._lease_seconds / HEARTBEATS_PER_LEASE)
+
+    async def _requeue_expired(self, pending: list[str]) -> None:
+        # Jobs accepted by a process that stopped renewing their leases
+        requeued = 0
+        for job_id in pending:
+            if job_id in self._held:
+                continue
+            try:
+                if await self._claim_expired(job_id):
+                    self._queue.put_nowait(job_id)
+                    requeued += 1
+            except Exception as e:
+                print(f"Error claiming {self.name} job {job_id}: {e}")
+        if requeued:
+            print(f"Requeued {requeued} abandoned {self.name} jobs")
+
+    async def _delete_finished(self, markers: list[str]) -> None:
+        # Every instance runs this; deleting a record another instance already removed just fails
+        now = time.time()
+        deleted = 0
+        for marker in markers:
+            expires_at, _, job_id = marker.partition("_")
+            if not expires_at.isdigit() or int(expires_at) > now:
+                continue
+            try:
+                job = await asyncio.to_thread(db.storage.json.get, self._job_key(job_id), default={})
+                # A job retried since is running again, or finished later with a new marker
+                if job and job.get("expires_at") is not None and job["expires_at"] <= now:
+                    self._recent.delete(job_id)
+                    await asyncio.to_thread(db.storage.json.delete, self._job_key(job_id))
+                    deleted += 1
+                await asyncio.to_thread(db.storage.json.delete, self._expiry_prefix + marker)
+            except Exception as e:
+                print(f"Error deleting finished {self.name} job {job_id}: {e}")
+        if deleted:
+            print(f"Deleted {deleted} finished {self.name} jobs past their TTL")
+
+    async def _list_bookkeeping_keys(self) -> list[str]:
+        try:
+            files = await asyncio.to_thread(db.storage.json.list)
+        except Exception as e:
+            print(f"Error listing {self.name} keys: {e}")
+            return []
+        return [file.name for file in files if file.name.startswith(self._bookkeeping_prefix)]
+
+    @staticmethod
+    def _ids(keys: list[str], prefix: str) -> list[str]:
+        return [key[len(prefix):] for key in keys if key.startswith(prefix)]
+
+    async def _claim_expired(self, job_id: str) -> bool:
+        lease = await asyncio.to_thread(db.storage.json.get, self._lease_key(job_id), default={})
+        if lease and lease.get("lease_until", 0) > time.time():
+            return False
+        await self._write_lease(job_id)
+        await asyncio.sleep(CLAIM_SETTLE_SECONDS)
+        lease = await asyncio.to_thread(db.storage.json.get, self._lease_key(job_id), default={})
+        if not lease or lease.get("owner") != self._instance:
+            return False
+        self._held.add(job_id)
+        return True
+
+    async def _hold(self, job_id: str) -> None:
+        self._held.add(job_id)
+        try:
+            await self._write_lease(job_id)
+        except Exception as e:
+            print(f"Error writing lease for {self.name} job {job_id}: {e}")
+
+    async def _renew_leases(self) -> None:
+        for job_id in list(self._held):
+            # Under the lock so a renewal can't rewrite the lease of a job released meanwhile
+            async with self._lease_lock:
+                if job_id in self._held:
+                    await self._write_lease(job_id)
+
+    async def _release(self, job_id: str) -> None:
+        async with self._lease_lock:
+            self._held.discard(job_id)
+            try:
+                await asyncio.to_thread(db.storage.json.delete, self._lease_key(job_id))
+            except Exception as e:
+                print(f"Error releasing lease for {self.name} job {job_id}: {e}")
+
+    async def _write_lease(self, job_id: str) -> None:
+        lease = {"owner": self._instance, "lease_until": time.time() + self._lease_seconds}
+        await asyncio.to_thread(db.storage.json.put, self._lease_key(job_id), lease)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Error running {self.name} job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        job = await self.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            await self._release(job_id)
+            return
+
+        job["status"] = JOB_RUNNING
+        job["attempts"] += 1
+        await self._save(job)
+        try:
+            job["result"] = await self._handler(job["payload"])
+            job["status"] = JOB_COMPLETED
+            job["error"] = None
+            self.processed += 1
+        except Exception as e:
+            job["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"{self.name} job {job_id} attempt {job['attempts']} failed: {job['error']}")
+            if job["attempts"] < self._max_attempts:
+                # Wait out the backoff on the event loop rather than in a worker; the lease
+                # is still held, so the heartbeat keeps the job from being swept meanwhile
+                job["status"] = JOB_QUEUED
+                await self._save(job)
+                delay = self._retry_delay * job["attempts"]
+                asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job_id)
+                return
+            job["status"] = JOB_FAILED
+            self.failed += 1
+            if self._dead_letter:
+                try:
+                    await asyncio.to_thread(db.storage.json.put, self._dead_letter_key(job_id), {"failed_at": datetime.now().isoformat()})
+                except Exception as e:
+                    print(f"Error dead-lettering {self.name} job {job_id}: {e}")
+
+        if job["status"] == JOB_COMPLETED and not self._keep_completed:
+            self._recent.delete(job_id)
+            try:
+                await asyncio.to_thread(db.storage.json.delete, self._job_key(job_id))
+            except Exception as e:
+                print(f"Error deleting {self.name} job {job_id}: {e}")
+        else:
+            expires = self._finished_ttl is not None and not (job["status"] == JOB_FAILED and self._dead_letter)
+            if expires:
+                job["expires_at"] = time.time() + self._finished_ttl
+            await self._save(job)
+            if expires:
+                try:
+                    await asyncio.to_thread(db.storage.json.put, self._expiry_key(job_id, job["expires_at"]), {})
+                except Exception as e:
+                    print(f"Error scheduling deletion of {self.name} job {job_id}: {e}")
+        await self._release(job_id)
+
+    async def _save(self, job: dict) -> None:
+        job["updated_at"] = datetime.now().isoformat()
+        if job["status"] in TERMINAL_STATUSES:
+            self._recent.set(job["id"], job)
+        else:
+            self._recent.delete(job["id"])
+        await asyncio.to_thread(db.storage.json.put, self._job_key(job["id"]), job)
@@ -0,0 +1,726 @@
+"""Keyword analysis pipeline shared by the keyword_research and keyword_research_fixed APIs.
+
+Both routers expose the same endpoints over this module, so they share one
+set of models, one analysis cache and one single-flight group: a request on
+either router can join a lookup started by the other and gets back the same
+model classes it validates against.
+
+Usage:
+
+    from app.libs.keyword_analysis_pipeline import KeywordSearchRequest, analyze_keywords_implementation
+
+    response = await analyze_keywords_implementation(KeywordSearchRequest(seed_keyword="budget"))
+"""
+
+import asyncio
+import json
+import random
+import re
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import databutton as db
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from app.libs.dataforseo_client import (
+    KEYWORDS_FOR_KEYWORDS_PATH,
+    LIVE_MAX_TASKS_PER_POST,
+    SEARCH_VOLUME_MAX_KEYWORDS,
+    SEARCH_VOLUME_PATH,
+    chunked,
+    dataforseo_post,
+    get_task_keywords,
+    task_succeeded
+)
+from app.libs.keyword_metrics_store import keyword_metrics_store
+from app.libs.lru_cache import LRUCache, estimate_size
+from app.libs.single_flight import get_single_flight
+
+# Keyword analysis results are cached for 7 days. Entries older than the freshness
+# threshold are still served, but refreshed in the background
+CACHE_TTL = timedelta(days=7)
+CACHE_FRESH_TTL = timedelta(days=1)
+
+# In-process tier in front of db.storage.json holding (validated response, cached_date)
+analysis_cache = LRUCache(
+    max_entries=1000,
+    max_bytes=20 * 1024 * 1024,
+    ttl_seconds=CACHE_TTL.total_seconds(),
+    sizeof=lambda entry: estimate_size(entry[0])
+)
+
+# Upper bound on seeds per /analyze-batch call
+MAX_BATCH_SEEDS = 200
+
+# Concurrent misses for the same cache key share one DataForSEO computation,
+# also across keyword_research and keyword_research_fixed
+analysis_flights = get_single_flight("keyword_analysis")
+
+# Keep references to background refreshes so they aren't garbage collected mid-flight
+refresh_tasks: set[asyncio.Task] = set()
+
+# A failed refresh falls back to sample data and leaves the entry stale, so each key is
+# refreshed at most once per backoff window instead of on every hit while DataForSEO is down
+REFRESH_BACKOFF = timedelta(minutes=15)
+refresh_attempts = LRUCache(max_entries=10000, max_bytes=2 * 1024 * 1024, ttl_seconds=REFRESH_BACKOFF.total_seconds())
+
+
+# Pydantic models for request/response
+class KeywordSearchRequest(BaseModel):
+    seed_keyword: str
+    location_code: int = 2840  # Default to US
+    language_code: str = "en"  # Default to English
+    limit: int = 10  # Number of keywords to return
+
+
+class KeywordBatchRequest(BaseModel):
+    seed_keywords: List[str]
+    location_code: int = 2840  # Default to US
+    language_code: str = "en"  # Default to English
+    limit: int = 10  # Number of keywords to return per seed
+
+
+class KeywordMetricsResponse(BaseModel):
+    keyword: str
+    search_volume: int
+    competition: str  # Low, Medium, High
+    cpc: float
+    category: str  # tool or monetization
+    difficulty: Optional[int] = None  # 0-100 scale
+    traffic_potential: Optional[int] = None
+
+
+class KeywordAnalysisResponse(BaseModel):
+    seed_keyword: str
+    tool_keywords: List[KeywordMetricsResponse]
+    monetization_keywords: List[KeywordMetricsResponse]
+    tags: List[str] = []
+
+
+class KeywordAnalysisStreamEvent(BaseModel):
+    event: str  # tool_keywords, monetization_keywords or complete
+    seed_keyword: str
+    tool_keywords: Optional[List[KeywordMetricsResponse]] = None
+    monetization_keywords: Optional[List[KeywordMetricsResponse]] = None
+    tags: Optional[List[str]] = None
+    result: Optional[KeywordAnalysisResponse] = None
+
+
+def sanitize_storage_key(key: str) -> str:
+    """Sanitize storage key to only allow alphanumeric and ._- symbols"""
+    return re.sub(r'[^a-zA-Z0-9._-]', '', key)
+
+
+def calculate_traffic_potential(search_volume: int, competition: str) -> int:
+    """Calculate potential traffic based on search volume and competition"""
+    if competition == "Low":
+        return int(search_volume * 0.1)  # Could rank high, get ~10% of traffic
+    elif competition == "Medium":
+        return int(search_volume * 0.05)  # Moderate ranking, ~5% of traffic
+    else:  # High
+        return int(search_volume * 0.01)  # Hard to rank, ~1% of traffic
+
+
+def get_seed_category(seed_keyword: str) -> tuple[str, List[str]]:
+    """Determine the category tag and high-value monetization terms for a seed keyword"""
+    seed_lower = seed_keyword.lower()
+    if "budget" in seed_lower or "money" in seed_lower or "spending" in seed_lower:
+        return "budgeting", ["financial advisor", "money management service", "budgeting app premium"]
+    elif "debt" in seed_lower or "loan" in seed_lower or "credit" in seed_lower:
+        return "debt", ["debt consolidation", "credit repair service", "loan refinancing"]
+    elif "save" in seed_lower or "saving" in seed_lower:
+        return "savings", ["high-yield savings account", "wealth management", "investment advisor"]
+    elif "invest" in seed_lower or "stock" in seed_lower or "portfolio" in seed_lower:
+        return "investment", ["investment advisor", "portfolio management", "stock broker service"]
+    elif "retire" in seed_lower or "401k" in seed_lower or "pension" in seed_lower:
+        return "retirement", ["retirement planning", "estate planning", "wealth advisor"]
+    else:
+        return "finance", ["financial advisor", "wealth management", "financial planning"]
+
+
+def get_cache_key(request: KeywordSearchRequest) -> str:
+    """Storage key of the cached analysis for a request"""
+    return sanitize_storage_key(f"keyword_analysis_{request.seed_keyword}_{request.language_code}_{request.location_code}")
+
+
+def extract_related_keywords(seed_keyword: str, keyword_data: list) -> List[str]:
+    """Pick related keywords from a keywords_for_keywords task, or generate similar ones"""
+    related_keywords = []
+    
+    # Filter for low competition keywords
+    for kw in keyword_data:
+        # Only include keywords with search volume data
+        if "search_volume" in kw and kw["search_volume"] and kw["search_volume"] > 0:
+            related_keywords.append(kw["keyword"])
+    
+    # Keep only the most relevant ones
+    related_keywords = related_keywords[:30]
+    
+    # If we got no related keywords, generate similar keywords based on the seed
+    if not related_keywords:
+        print(f"No related keywords found for '{seed_keyword}', generating similar ones")
+        # Generate similar keywords based on the seed
+        variations = [
+            "calculator", "template", "spreadsheet", "planner", "tracker", "worksheet",
+            "free", "tool", "guide", "app", "online", "excel", "pdf", "printable"
+        ]
+        related_keywords = [seed_keyword] + [f"{seed_keyword} {v}" for v in variations[:15]]
+    
+    return related_keywords
+
+
+def categorize_keywords(volume_data: list) -> tuple[List[KeywordMetricsResponse], List[KeywordMetricsResponse]]:
+    """Split search volume results into tool and monetization keywords, sorted by relevance"""
+    tool_keywords = []
+    monetization_keywords = []
+    
+    # Categorize keywords based on CPC and competition
+    for kw in volume_data:
+        if not kw.get("keyword") or not kw.get("search_volume"):
+            continue
+            
+        # Get competition level
+        competition = "Medium"
+        competition_index = kw.get("competition_index", 0.5)
+        if competition_index < 0.33:
+            competition = "Low"
+        elif competition_index > 0.66:
+            competition = "High"
+        
+        # Calculate traffic potential
+        traffic_potential = calculate_traffic_potential(kw.get("search_volume", 0), competition)
+        
+        # Determine if this is a tool or monetization keyword
+        kw_data = {
+            "keyword": kw["keyword"],
+            "search_volume": kw.get("search_volume", 0),
+            "competition": competition,
+            "cpc": kw.get("cpc", 0.0),
+            "difficulty": int(competition_index * 100),
+            "traffic_potential": traffic_potential,
+            "category": "unknown"
+        }
+        
+        if competition == "Low" and kw.get("cpc", 0) < 2.0:
+            kw_data["category"] = "tool"
+            tool_keywords.append(KeywordMetricsResponse(**kw_data))
+        elif kw.get("cpc", 0) > 3.0:
+            kw_data["category"] = "monetization"
+            monetization_keywords.append(KeywordMetricsResponse(**kw_data))
+    
+    # Sort keywords by relevance
+    tool_keywords.sort(key=lambda x: x.search_volume, reverse=True)
+    monetization_keywords.sort(key=lambda x: x.cpc, reverse=True)
+    
+    return tool_keywords, monetization_keywords
+
+
+def parse_monetization_keywords(volume_data: list) -> List[KeywordMetricsResponse]:
+    """Build monetization keywords from search volume results for high-value terms"""
+    monetization_keywords = []
+    
+    for kw in volume_data:
+        if not kw.get("keyword") or not kw.get("search_volume"):
+            continue
+            
+        # Calculate traffic potential (low for high competition keywords)
+        traffic_potential = calculate_traffic_potential(kw.get("search_volume", 0), "High")
+        
+        kw_data = {
+            "keyword": kw["keyword"],
+            "search_volume": kw.get("search_volume", 0),
+            "competition": "High",
+            "cpc": kw.get("cpc", 10.0),
+            "category": "monetization",
+            "difficulty": 85,  # High-value terms are usually competitive
+            "traffic_potential": traffic_potential
+        }
+        monetization_keywords.append(KeywordMetricsResponse(**kw_data))
+    
+    return monetization_keywords
+
+
+def needs_monetization_terms(tool_keywords: list, monetization_keywords: list) -> bool:
+    """Whether too few keywords came back and the high-value terms should be added"""
+    return len(tool_keywords) < 3 or len(monetization_keywords) < 3
+
+
+def build_analysis_response(
+    request: KeywordSearchRequest,
+    category_tag: str,
+    tool_keywords: List[KeywordMetricsResponse],
+    monetization_keywords: List[KeywordMetricsResponse]
+) -> KeywordAnalysisResponse:
+    """Limit the categorized keywords and assemble the analysis response"""
+    # Limit results
+    tool_keywords = tool_keywords[:request.limit]
+    monetization_keywords = monetization_keywords[:request.limit]
+    
+    # Log what we're about to return
+    print(f"Final data: {len(tool_keywords)} tool keywords, {len(monetization_keywords)} monetization keywords")
+    
+    return KeywordAnalysisResponse(
+        seed_keyword=request.seed_keyword,
+        tool_keywords=tool_keywords,
+        monetization_keywords=monetization_keywords,
+        tags=[category_tag, "keyword-research"]
+    )
+
+
+async def fetch_search_volume(keywords: List[str], location_code: int, language_code: str) -> Dict[str, dict]:
+    """
+    Get search volume items keyed by lowercased keyword. Only keywords missing from
+    the keyword metrics store are requested from DataForSEO.
+    """
+    volume_by_keyword, missing = keyword_metrics_store.get_many(keywords, location_code, language_code)
+    print(f"Search volume: {len(volume_by_keyword)} keywords from metrics store, {len(missing)} to fetch")
+    
+    if not missing:
+        return volume_by_keyword
+    
+    keyword_tasks = [{"keywords": task_keywords} for task_keywords in chunked(missing, SEARCH_VOLUME_MAX_KEYWORDS)]
+    for task_chunk in chunked(keyword_tasks, LIVE_MAX_TASKS_PER_POST):
+        search_response = await dataforseo_post(SEARCH_VOLUME_PATH, task_chunk)
+        
+        if search_response.status_code != 200:
+            raise HTTPException(status_code=search_response.status_code, detail=f"DataForSEO API error: {search_response.text}")
+        
+        search_volume_result = search_response.json()
+        
+        # Log the response structure to debug
+        print(f"Search volume API response: {json.dumps(search_volume_result, indent=2)[:500]}...")
+        
+        for index, task in enumerate(task_chunk):
+            volume_data = get_task_keywords(search_volume_result, index)
+            # Only a completed task shows that the keywords it left out have no data
+            if task_succeeded(search_volume_result, index):
+                keyword_metrics_store.put_many(task["keywords"], volume_data, location_code, language_code)
+            else:
+                print(f"Search volume task {index} failed, not caching its missing keywords")
+                keyword_metrics_store.put_many([], volume_data, location_code, language_code)
+            for kw in volume_data:
+                if kw.get("keyword"):
+                    volume_by_keyword[kw["keyword"].lower()] = kw
+    
+    return volume_by_keyword
+
+
+def select_volume_data(volume_by_keyword: Dict[str, dict], keywords: List[str]) -> list:
+    """Search volume items for the given keywords, in order, skipping ones without data"""
+    return [volume_by_keyword[kw.lower()] for kw in keywords if kw.lower() in volume_by_keyword]
+
+
+async def fetch_monetization_keywords(monetization_terms: List[str], request: KeywordSearchRequest) -> List[KeywordMetricsResponse]:
+    """Get search volume for high-value monetization terms"""
+    try:
+        volume_by_keyword = await fetch_search_volume(monetization_terms, request.location_code, request.language_code)
+    except HTTPException:
+        return []
+    
+    return parse_monetization_keywords(select_volume_data(volume_by_keyword, monetization_terms))
+
+
+def sample_keyword_analysis(request: KeywordSearchRequest) -> KeywordAnalysisResponse:
+    """Sample data for a seed keyword, used when DataForSEO fails and for testing"""
+    # Generate sample data based on the seed keyword
+    seed_keyword = request.seed_keyword.lower()
+    
+    # Generate tool keywords
+    tool_keywords = []
+    tool_variations = [
+        "template", "calculator", "spreadsheet", "tool", "tracker", "planner", 
+        "worksheet", "guide", "checklist", "budget", "free", "diy", "simple"
+    ]
+    
+    for i in range(min(request.limit, 5)):
+        variation = tool_variations[i % len(tool_variations)]
+        keyword = f"{seed_keyword} {variation}"
+        search_volume = random.randint(1000, 10000)
+        competition_index = random.uniform(0.1, 0.4)  # Low competition
+        cpc = random.uniform(0.2, 1.5)
+        
+        tool_keywords.append(KeywordMetricsResponse(
+            keyword=keyword,
+            search_volume=search_volume,
+            competition="Low",
+            cpc=cpc,
+            category="tool",
+            difficulty=int(competition_index * 100),
+            traffic_potential=calculate_traffic_potential(search_volume, "Low")
+        ))
+    
+    # Generate monetization keywords
+    monetization_keywords = []
+    monetization_variations = [
+        "premium", "professional", "advisor", "consultant", "service", "management",
+        "best", "expert", "certified", "top", "agency", "wealth", "investment"
+    ]
+    
+    for i in range(min(request.limit, 5)):
+        variation = monetization_variations[i % len(monetization_variations)]
+        keyword = f"{variation} {seed_keyword}"
+        search_volume = random.randint(500, 5000)
+        competition_index = random.uniform(0.6, 0.9)  # High competition
+        cpc = random.uniform(5.0, 20.0)  # High CPC
+        
+        monetization_keywords.append(KeywordMetricsResponse(
+            keyword=keyword,
+            search_volume=search_volume,
+            competition="High",
+            cpc=cpc,
+            category="monetization",
+            difficulty=int(competition_index * 100),
+            traffic_potential=calculate_traffic_potential(search_volume, "High")
+        ))
+    
+    # Determine category tag based on the seed keyword
+    category_tag, _ = get_seed_category(seed_keyword)
+    
+    # Return the sample data response
+    return KeywordAnalysisResponse(
+        seed_keyword=request.seed_keyword,
+        tool_keywords=tool_keywords,
+        monetization_keywords=monetization_keywords,
+        tags=[category_tag, "keyword-research"]
+    )
+
+
+async def analyze_keywords_implementation(request: KeywordSearchRequest) -> KeywordAnalysisResponse:
+    """
+    Analyze keywords to find low-competition tool keywords and high-value monetization keywords
+    """
+    print(f"Analyzing keyword: {request.seed_keyword}")
+    
+    cache_key = get_cache_key(request)
+    cached_response = await get_cached_analysis(request, cache_key)
+    if cached_response is not None:
+        return cached_response
+    
+    # Join an identical lookup already in flight instead of paying for another one
+    return await analysis_flights.do(cache_key, lambda: fetch_keyword_analysis(request, cache_key))
+
+
+async def get_cached_analysis(
+    request: KeywordSearchRequest,
+    cache_key: str,
+    stale: Optional[List[tuple[KeywordSearchRequest, str]]] = None
+) -> Optional[KeywordAnalysisResponse]:
+    """
+    Look up a cached analysis in the in-process tier, then the storage tier (cache for 7 days)
+    
+    Stale hits are refreshed in the background, or appended to stale when it is given
+    so the caller can refresh them together.
+    """
+    cached_entry = analysis_cache.get(cache_key)
+    if cached_entry is not None:
+        cached_response, cached_date = cached_entry
+        if datetime.now() - cached_date >= CACHE_FRESH_TTL:
+            mark_stale(request, cache_key, stale)
+        return cached_response
+    
+    try:
+        cached_result = await asyncio.to_thread(db.storage.json.get, cache_key)
+        if cached_result and 'cached_date' in cached_result:
+            cached_date = datetime.fromisoformat(cached_result['cached_date'])
+            age = datetime.now() - cached_date
+            if age < CACHE_TTL:
+                # Remove cached_date from response
+                del cached_result['cached_date']
+                cached_response = KeywordAnalysisResponse.parse_obj(cached_result)
+                # Keep the validated response in memory for the rest of its lifetime
+                analysis_cache.set(cache_key, (cached_response, cached_date), ttl_seconds=(CACHE_TTL - age).total_seconds())
+                if age >= CACHE_FRESH_TTL:
+                    mark_stale(request, cache_key, stale)
+                return cached_response
+    except Exception as e:
+        print(f"Cache retrieval error: {e}")
+        # If error or not found, continue with API call
+    
+    return None
+
+
+async def cache_analysis(cache_key: str, response: KeywordAnalysisResponse) -> None:
+    """Cache a result in memory and write through to storage with timestamp"""
+    cached_date = datetime.now()
+    analysis_cache.set(cache_key, (response, cached_date))
+    try:
+        cache_data = json.loads(response.json())
+        cache_data['cached_date'] = cached_date.isoformat()
+        await asyncio.to_thread(db.storage.json.put, cache_key, cache_data)
+    except Exception as e:
+        print(f"Error caching result: {e}")
+
+
+def mark_stale(
+    request: KeywordSearchRequest,
+    cache_key: str,
+    stale: Optional[List[tuple[KeywordSearchRequest, str]]]
+) -> None:
+    """Queue a stale hit on the caller's list, or refresh it right away if there is none"""
+    if stale is None:
+        schedule_cache_refresh([(request, cache_key)])
+    else:
+        stale.append((request, cache_key))
+
+
+def schedule_cache_refresh(stale: List[tuple[KeywordSearchRequest, str]]) -> None:
+    """Refresh stale cache entries in the background, as one packed batch, while the stale copies are served"""
+    requests_by_key = {
+        cache_key: request for request, cache_key in stale
+        if not analysis_flights.is_in_flight(cache_key) and refresh_attempts.get(cache_key) is None
+    }
+    if not requests_by_key:
+        return
+    
+    for cache_key in requests_by_key:
+        refresh_attempts.set(cache_key, True)
+    
+    print(f"Refreshing {len(requests_by_key)} stale keyword analyses in background")
+    task = asyncio.create_task(analysis_flights.do_many(
+        list(requests_by_key),
+        lambda cache_keys: fetch_keyword_analyses([(requests_by_key[cache_key], cache_key) for cache_key in cache_keys])
+    ))
+    refresh_tasks.add(task)
+    task.add_done_callback(refresh_tasks.discard)
+
+
+async def fetch_keyword_analysis(
+    request: KeywordSearchRequest,
+    cache_key: str,
+    on_tool_keywords: Optional[Callable[[List[KeywordMetricsResponse]], None]] = None
+) -> KeywordAnalysisResponse:
+    """
+    Run the DataForSEO pipeline for a seed keyword and cache the result
+    
+    Args:
+        request: The keyword search request
+        cache_key: Storage key to cache the result under
+        on_tool_keywords: Called with the limited tool keywords as soon as they are categorized
+    """
+    # The seed's category and monetization terms don't depend on any API result,
+    # so start the monetization lookup now and overlap it with the tool keyword calls
+    category_tag, monetization_terms = get_seed_category(request.seed_keyword)
+    monetization_task = asyncio.create_task(fetch_monetization_keywords(monetization_terms, request))
+    
+    try:
+        # Step 1: Get related "tool" keywords
+        tool_keywords_data = [{"keywords": [request.seed_keyword]}]
+        
+        print(f"Using DataForSEO client for keyword: {request.seed_keyword}")
+        
+        # First, get related keywords through the shared connection pool
+        response = await dataforseo_post(KEYWORDS_FOR_KEYWORDS_PATH, tool_keywords_data)
+        
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"DataForSEO API error: {response.text}")
+        
+        related_keywords = extract_related_keywords(request.seed_keyword, get_task_keywords(response.json()))
+            
+        # Only keywords missing from the metrics store are sent to DataForSEO
+        volume_by_keyword = await fetch_search_volume(related_keywords, request.location_code, request.language_code)
+        
+        # Process search volume results
+        volume_data = select_volume_data(volume_by_keyword, related_keywords)
+        print(f"Found {len(volume_data)} keywords with search volume data")
+        tool_keywords, monetization_keywords = categorize_keywords(volume_data)
+        
+        print(f"Got real data for: {request.seed_keyword} ({len(tool_keywords)} keywords)")
+        
+        # Log what we found so far
+        print(f"Processed keywords: {len(tool_keywords)} tool keywords, {len(monetization_keywords)} monetization keywords")
+        
+        if on_tool_keywords:
+            on_tool_keywords(tool_keywords[:request.limit])
+        
+        # If we don't have enough keywords, add the high-value terms fetched in parallel
+        if needs_monetization_terms(tool_keywords, monetization_keywords):
+            monetization_keywords.extend(await monetization_task)
+        
+        response = build_analysis_response(request, category_tag, tool_keywords, monetization_keywords)
+        
+        await cache_analysis(cache_key, response)
+        
+        return response
+    
+    except Exception as e:
+        print(f"Error analyzing keywords: {str(e)}, falling back to sample data")
+        return sample_keyword_analysis(request)
+    
+    finally:
+        # Drop the speculative monetization lookup if its result wasn't needed
+        if not monetization_task.done():
+            monetization_task.cancel()
+        elif not monetization_task.cancelled():
+            # Retrieve any error from an unused lookup so it isn't reported as unhandled
+            monetization_task.exception()
+
+
+async def fetch_keyword_analyses(misses: List[tuple[KeywordSearchRequest, str]]) -> List[KeywordAnalysisResponse]:
+    """
+    Run the DataForSEO pipeline for many seed keywords with as few POSTs as the API allows
+    
+    Args:
+        misses: (request, cache_key) pairs that weren't found in the cache
+        
+    Returns:
+        One response per seed, in the same order
+    """
+    # Step 1: related keywords, one task per seed since suggestions can't be told apart by seed
+    related_by_key = {}
+    failed_keys = set()
+    seed_chunks = list(chunked(misses, LIVE_MAX_TASKS_PER_POST))
+    results = await asyncio.gather(
+        *[dataforseo_post(KEYWORDS_FOR_KEYWORDS_PATH, [{"keywords": [seed_request.seed_keyword]} for seed_request, _ in chunk])
+          for chunk in seed_chunks],
+        return_exceptions=True
+    )
+    for chunk, result in zip(seed_chunks, results):
+        if isinstance(result, Exception) or result.status_code != 200:
+            print(f"Error getting related keywords for batch: {result if isinstance(result, Exception) else result.text}")
+            failed_keys.update(cache_key for _, cache_key in chunk)
+            continue
+        
+        tool_keywords_result = result.json()
+        for index, (seed_request, cache_key) in enumerate(chunk):
+            related_by_key[cache_key] = extract_related_keywords(seed_request.seed_keyword, get_task_keywords(tool_keywords_result, index))
+    
+    # Step 2: search volume for every related keyword and monetization term, deduped across seeds
+    categories = {cache_key: get_seed_category(seed_request.seed_keyword) for seed_request, cache_key in misses}
+    all_keywords = list(dict.fromkeys(
+        [kw for related_keywords in related_by_key.values() for kw in related_keywords]
+        + [term for _, monetization_terms in categories.values() for term in monetization_terms]
+    ))
+    
+    volume_by_keyword = {}
+    try:
+        batch_request = misses[0][0]
+        volume_by_keyword = await fetch_search_volume(all_keywords, batch_request.location_code, batch_request.language_code)
+    except Exception as e:
+        print(f"Error getting batch search volume: {str(e)}, falling back to sample data")
+        failed_keys.update(cache_key for _, cache_key in misses)
+    
+    # Split the shared results back out per seed
+    responses = []
+    computed = []
+    for seed_request, cache_key in misses:
+        if cache_key in failed_keys:
+            responses.append(sample_keyword_analysis(seed_request))
+            continue
+        
+        category_tag, monetization_terms = categories[cache_key]
+        volume_data = select_volume_data(volume_by_keyword, related_by_key[cache_key])
+        tool_keywords, monetization_keywords = categorize_keywords(volume_data)
+        
+        if needs_monetization_terms(tool_keywords, monetization_keywords):
+            monetization_keywords.extend(parse_monetization_keywords(select_volume_data(volume_by_keyword, monetization_terms)))
+        
+        response = build_analysis_response(seed_request, category_tag, tool_keywords, monetization_keywords)
+        responses.append(response)
+        computed.append((cache_key, response))
+    
+    await asyncio.gather(*[cache_analysis(cache_key, response) for cache_key, response in computed])
+    
+    return responses
+
+
+async def stream_batch_analysis(batch: KeywordBatchRequest) -> AsyncIterator[str]:
+    """Yield one NDJSON line per unique seed: cache hits first, then fresh analyses"""
+    # Dedupe seeds on their cache key, keeping the first spelling
+    seed_requests = {}
+    for seed_keyword in batch.seed_keywords:
+        if not seed_keyword.strip():
+            continue
+        seed_request = KeywordSearchRequest(
+            seed_keyword=seed_keyword,
+            location_code=batch.location_code,
+            language_code=batch.language_code,
+            limit=batch.limit
+        )
+        seed_requests.setdefault(get_cache_key(seed_request), seed_request)
+    
+    misses = []
+    stale = []
+    for cache_key, seed_request in seed_requests.items():
+        cached_response = await get_cached_analysis(seed_request, cache_key, stale)
+        if cached_response is not None:
+            yield cached_response.json() + "\n"
+        else:
+            misses.append(cache_key)
+    
+    # Stale hits were served as-is; refresh them together instead of one pipeline each
+    schedule_cache_refresh(stale)
+    
+    print(f"Batch analysis: {len(seed_requests)} seeds, {len(misses)} cache misses, {len(stale)} stale")
+    
+    if misses:
+        # Misses are registered as flights, so single-seed requests for them join this batch;
+        # seeds another request is already computing just wait for that result
+        responses = await analysis_flights.do_many(
+            misses,
+            lambda cache_keys: fetch_keyword_analyses([(seed_requests[cache_key], cache_key) for cache_key in cache_keys])
+        )
+        for response in responses:
+            yield response.json() + "\n"
+
+
+async def stream_keyword_analysis(request: KeywordSearchRequest) -> AsyncIterator[str]:
+    """
+    Yield NDJSON analysis events for one seed. The complete event carries the final
+    response, which replaces the earlier partial events if the pipeline fell back to sample data.
+    """
+    print(f"Streaming analysis for keyword: {request.seed_keyword}")
+    
+    cache_key = get_cache_key(request)
+    response = await get_cached_analysis(request, cache_key)
+    tool_keywords_sent = False
+    
+    if response is None:
+        tool_stage: asyncio.Queue = asyncio.Queue()
+        analysis_task = asyncio.ensure_future(analysis_flights.do(
+            cache_key,
+            lambda: fetch_keyword_analysis(request, cache_key, on_tool_keywords=tool_stage.put_nowait)
+        ))
+        tool_stage_task = asyncio.ensure_future(tool_stage.get())
+        
+        # A lookup another request started won't report its stages, so also wait on the result
+        await asyncio.wait({analysis_task, tool_stage_task}, return_when=asyncio.FIRST_COMPLETED)
+        if tool_stage_task.done():
+            event = KeywordAnalysisStreamEvent(
+                event="tool_keywords",
+                seed_keyword=request.seed_keyword,
+                tool_keywords=tool_stage_task.result()
+            )
+            yield event.json() + "\n"
+            tool_keywords_sent = True
+        else:
+            tool_stage_task.cancel()
+        
+        response = await analysis_task
+    
+    if not tool_keywords_sent:
+        event = KeywordAnalysisStreamEvent(
+            event="tool_keywords",
+            seed_keyword=request.seed_keyword,
+            tool_keywords=response.tool_keywords
+        )
+        yield event.json() + "\n"
+    
+    event = KeywordAnalysisStreamEvent(
+        event="monetization_keywords",
+        seed_keyword=request.seed_keyword,
+        monetization_keywords=response.monetization_keywords,
+        tags=response.tags
+    )
+    yield event.json() + "\n"
+    
+    yield KeywordAnalysisStreamEvent(event="complete", seed_keyword=request.seed_keyword, result=response).json() + "\n"
+
+
+def get_analysis_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters and occupancy of the in-process keyword analysis cache"""
+    return {
+        **analysis_cache.stats(),
+        "single_flight": analysis_flights.stats(),
+        "keyword_metrics": keyword_metrics_store.stats()
+    }
@@ -0,0 +1,73 @@
+"""Keyword-level store of DataForSEO search volume results.
+
+Long-tail keywords such as "budget template" come back under many seeds.
+Keeping their metrics per (keyword, location_code, language_code) lets the
+keyword APIs request only the keywords they haven't seen recently.
+
+Usage:
+
+    from app.libs.keyword_metrics_store import keyword_metrics_store
+
+    found, missing = keyword_metrics_store.get_many(keywords, 2840, "en")
+    # ... fetch `missing` from DataForSEO ...
+    keyword_metrics_store.put_many(missing, results, 2840, "en")
+"""
+
+from app.libs.lru_cache import LRUCache
+
+# Search volume data changes slowly, but CPC and competition drift within weeks
+METRICS_TTL_SECONDS = 3 * 24 * 3600
+
+
+class KeywordMetricsStore:
+    """In-process TTL store of raw search volume items per keyword"""
+
+    def __init__(self, max_entries: int = 50000, ttl_seconds: float = METRICS_TTL_SECONDS):
+        self._cache = LRUCache(
+            max_entries=max_entries,
+            max_bytes=50 * 1024 * 1024,
+            ttl_seconds=ttl_seconds,
+        )
+
+    @staticmethod
+    def _key(keyword: str, location_code: int, language_code: str) -> str:
+        return f"{keyword.lower()}|{location_code}|{language_code}"
+
+    def get_many(
+        self, keywords: list[str], location_code: int, language_code: str
+    ) -> tuple[dict[str, dict], list[str]]:
+        """Split keywords into stored metrics (by lowercased keyword) and ones still missing"""
+        found = {}
+        missing = []
+        for keyword in keywords:
+            item = self._cache.get(self._key(keyword, location_code, language_code))
+            if item is None:
+                missing.append(keyword)
+            else:
+                found[keyword.lower()] = item
+        return found, missing
+
+    def put_many(
+        self, requested: list[str], items: list[dict], location_code: int, language_code: str
+    ) -> None:
+        """Store returned items, and remember requested keywords that came back without data"""
+        returned = set()
+        for item in items:
+            if not item.get("keyword"):
+                continue
+            returned.add(item["keyword"].lower())
+            self._cache.set(self._key(item["keyword"], location_code, language_code), item)
+
+        # Without a negative entry these would be re-requested on every lookup
+        for keyword in requested:
+            if keyword.lower() not in returned:
+                self._cache.set(
+                    self._key(keyword, location_code, language_code),
+                    {"keyword": keyword, "search_volume": 0},
+                )
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+keyword_metrics_store = KeywordMetricsStore()
@@ -0,0 +1,87 @@
+"""Bucketed latency histograms with decay, for adaptive timeouts and stats.
+
+Counts are halved every `decay_every` samples, so quantiles follow recent
+behaviour (e.g. a backend getting slower) instead of the whole process
+lifetime.
+
+Usage:
+
+    from app.libs.latency_histogram import get_latency_histogram
+
+    histogram = get_latency_histogram("openai_first_token_azure")
+    histogram.record(1.8)
+    budget = histogram.quantile(0.95)  # None until there are samples
+"""
+
+import functools
+
+# Upper bounds in seconds; the last bucket catches everything slower
+DEFAULT_BOUNDS = (0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 4, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120)
+
+
+class LatencyHistogram:
+    """Latency distribution over fixed buckets"""
+
+    def __init__(self, bounds: tuple[float, ...] = DEFAULT_BOUNDS, decay_every: int = 200):
+        self._bounds = bounds
+        self._counts = [0.0] * (len(bounds) + 1)
+        self._decay_every = decay_every
+        self._since_decay = 0
+        self.total = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        index = len(self._bounds)
+        for i, bound in enumerate(self._bounds):
+            if seconds <= bound:
+                index = i
+                break
+        self._counts[index] += 1
+        self.total += 1
+        self.total_seconds += seconds
+
+        self._since_decay += 1
+        if self._since_decay >= self._decay_every:
+            self._counts = [count / 2 for count in self._counts]
+            self._since_decay = 0
+
+    def weight(self) -> float:
+        """Decayed sample count that quantiles are based on"""
+        return sum(self._counts)
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate the q-quantile by interpolating within its bucket"""
+        weight = self.weight()
+        if weight == 0:
+            return None
+
+        target = q * weight
+        cumulative = 0.0
+        for i, count in enumerate(self._counts):
+            if count and cumulative + count >= target:
+                lower = self._bounds[i - 1] if i > 0 else 0.0
+                # The overflow bucket has no upper bound; report its lower edge
+                if i == len(self._bounds):
+                    return lower
+                upper = self._bounds[i]
+                return lower + (upper - lower) * (target - cumulative) / count
+            cumulative += count
+        return self._bounds[-1]
+
+    def stats(self) -> dict:
+        labels = [f"<={bound}" for bound in self._bounds] + [f">{self._bounds[-1]}"]
+        return {
+            "count": self.total,
+            "mean": self.total_seconds / self.total if self.total else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {label: round(count, 2) for label, count in zip(labels, self._counts) if count},
+        }
+
+
+@functools.cache
+def get_latency_histogram(name: str) -> LatencyHistogram:
+    """Process-wide histogram by name"""
+    return LatencyHistogram()
@@ -0,0 +1,84 @@
+"""Process-wide async OpenAI and Azure OpenAI clients.
+
+Clients are built lazily from the OPENAI_API_KEY / OPENAI_PROJECT_ID secrets
+on first use and then reused, so every completion shares pooled HTTP
+connections. A semaphore bounds how many completions run at once per worker.
+
+Usage:
+
+    from app.libs.openai_clients import completion_slot, get_azure_openai_client, get_openai_client
+
+    async with completion_slot():
+        response = await get_openai_client().chat.completions.create(...)
+"""
+
+import asyncio
+
+import databutton as db
+import httpx
+from fastapi import HTTPException
+from openai import AsyncAzureOpenAI, AsyncOpenAI
+
+AZURE_API_VERSION = "2023-12-01-preview"
+
+# Completions in flight per worker; further requests wait for a slot
+MAX_CONCURRENT_COMPLETIONS = 20
+
+# Long generations stream for a while, so the read timeout is generous
+REQUEST_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+CONNECTION_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+
+_openai_client: AsyncOpenAI | None = None
+_azure_client: AsyncAzureOpenAI | None = None
+_azure_checked = False
+_semaphore: asyncio.Semaphore | None = None
+
+
+def _get_api_key() -> str:
+    api_key = db.secrets.get("OPENAI_API_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+    return api_key
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=CONNECTION_LIMITS)
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """Return the shared standard OpenAI client"""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(api_key=_get_api_key(), http_client=_build_http_client())
+    return _openai_client
+
+
+def get_azure_openai_client() -> AsyncAzureOpenAI | None:
+    """Return the shared Azure OpenAI client, or None when no project ID is configured"""
+    global _azure_client, _azure_checked
+    if not _azure_checked:
+        api_key = _get_api_key()
+        project_id = db.secrets.get("OPENAI_PROJECT_ID")
+        if project_id:
+            try:
+                _azure_client = AsyncAzureOpenAI(
+                    api_key=api_key,
+                    api_version=AZURE_API_VERSION,
+                    azure_endpoint=f"https://{project_id}.openai.azure.com",
+                    http_client=_build_http_client()
+                )
+                print(f"Using Azure OpenAI with project ID: {project_id}")
+            except Exception as e:
+                print(f"Error initializing Azure OpenAI: {e}. Falling back to standard OpenAI API.")
+        else:
+            print("Using standard OpenAI API")
+        _azure_checked = True
+    return _azure_client
+
+
+def completion_slot() -> asyncio.Semaphore:
+    """Semaphore bounding concurrent completions in this worker"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENT_COMPLETIONS)
+    return _semaphore
@@ -0,0 +1,198 @@
+"""Counters buffered in memory and flushed to one of a fixed pool of storage slots.
+
+Increments are added to an in-memory delta that a background thread (and
+atexit) flushes every flush_interval seconds. Each process leases one slot
+key, {name}_shard_{i}, and is the only writer of it, so no increment is lost
+to a concurrent read-modify-write. Flushes double as heartbeats; a slot whose
+owner stopped flushing for lease_seconds is taken over by the next process
+that needs one, which keeps the counts already in it. The number of keys
+therefore stays fixed however many processes come and go, and reads sum a
+known set of keys with no index. That is one get per slot, so the stored part
+of read() is cached for read_cache_seconds; this process's own increments are
+always included as they happen.
+
+Usage:
+
+    from app.libs.sharded_counters import ShardedCounters
+
+    counters = ShardedCounters("stripe_subscription_metrics")
+    counters.add({"active_subscriptions": 1, "trial_subscriptions": -1})
+    totals = counters.read()
+"""
+
+import atexit
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+import databutton as db
+
+# Storage has no compare-and-set, so a claim waits for competing writes before reading back
+CLAIM_SETTLE_SECONDS = 1.0
+
+
+def _merge(counts: dict, values: dict) -> None:
+    for field, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            counts[field] = counts.get(field, 0) + value
+
+
+class ShardedCounters:
+    """Named numeric counters with buffered persistence in leased storage slots"""
+
+    def __init__(
+        self,
+        name: str,
+        flush_interval: float = 30.0,
+        base_key: Optional[str] = None,
+        slots: int = 32,
+        lease_seconds: float = 300.0,
+        read_cache_seconds: float = 5.0,
+    ):
+        self.name = name
+        self._flush_interval = flush_interval
+        self._base_key = base_key
+        self._slot_count = slots
+        self._lease_seconds = lease_seconds
+        self._read_cache_seconds = read_cache_seconds
+        self._owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: dict[str, float] = {}
+        # Counts in the held slot as of the last flush, including any inherited with it
+        self._totals: dict[str, float] = {}
+        self._slot_key: Optional[str] = None
+        self._flusher: Optional[threading.Thread] = None
+        self._updated_at: Optional[str] = None
+        # (read at, own slot then, counts, update times) from the last read of the other slots
+        self._stored: Optional[tuple[float, Optional[str], dict, list]] = None
+
+    def _slot_keys(self) -> list[str]:
+        return [f"{self.name}_shard_{index}" for index in range(self._slot_count)]
+
+    def add(self, deltas: dict[str, float]) -> None:
+        """Buffer increments (negative for decrements) for the next flush"""
+        with self._lock:
+            for field, delta in deltas.items():
+                if delta:
+                    self._pending[field] = self._pending.get(field, 0) + delta
+            self._updated_at = datetime.now().isoformat()
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name=f"{self.name}_flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def flush(self) -> None:
+        """Write buffered increments to this process's slot, claiming one first if needed"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                updated_at = self._updated_at
+            if not pending and self._slot_key is None:
+                return
+
+            try:
+                if self._slot_key is not None and not self._still_owned():
+                    # Taken over after missed heartbeats; the new owner kept what was flushed
+                    print(f"Lost {self.name} slot {self._slot_key} to another process")
+                    with self._lock:
+                        self._slot_key, self._totals = None, {}
+                    if not pending:
+                        return
+                if self._slot_key is None and not self._claim_slot():
+                    raise RuntimeError("no free slot")
+
+                totals = dict(self._totals)
+                for field, delta in pending.items():
+                    totals[field] = totals.get(field, 0) + delta
+                db.storage.json.put(self._slot_key, self._slot_record(totals, updated_at))
+                with self._lock:
+                    self._totals = totals
+            except Exception as e:
+                print(f"Error flushing {self.name} counters: {e}")
+                # Put the increments back so the next flush retries them
+                with self._lock:
+                    for field, delta in pending.items():
+                        self._pending[field] = self._pending.get(field, 0) + delta
+
+    def read(self) -> dict:
+        """
+        Merged counts across the legacy base, all slots and unflushed increments, with
+        last_updated set to the most recent change
+        """
+        with self._lock:
+            own_slot = self._slot_key
+        stored = self._stored
+        if stored is None or stored[1] != own_slot or time.monotonic() - stored[0] >= self._read_cache_seconds:
+            stored = (time.monotonic(), own_slot, *self._read_stored(own_slot))
+            self._stored = stored
+        counts, updated = dict(stored[2]), list(stored[3])
+
+        # This process's slot is read from memory, which is never behind storage
+        with self._lock:
+            _merge(counts, self._totals)
+            _merge(counts, self._pending)
+            if self._updated_at:
+                updated.append(self._updated_at)
+
+        counts["last_updated"] = max(updated) if updated else None
+        return counts
+
+    def _read_stored(self, own_slot: Optional[str]) -> tuple[dict, list]:
+        """Counts and update times from the base key and every slot but this process's"""
+        counts: dict[str, float] = {}
+        updated = []
+
+        if self._base_key:
+            try:
+                base = db.storage.json.get(self._base_key, default={})
+                _merge(counts, base)
+                if base.get("last_updated"):
+                    updated.append(base["last_updated"])
+            except Exception as e:
+                print(f"Error reading {self.name} base counts: {e}")
+
+        for slot_key in self._slot_keys():
+            if slot_key == own_slot:
+                continue
+            try:
+                slot = db.storage.json.get(slot_key, default={})
+            except Exception as e:
+                print(f"Error reading {self.name} slot {slot_key}: {e}")
+                continue
+            _merge(counts, slot.get("counts", {}))
+            if slot.get("updated_at"):
+                updated.append(slot["updated_at"])
+        return counts, updated
+
+    def _slot_record(self, totals: dict, updated_at: Optional[str]) -> dict:
+        return {"counts": totals, "updated_at": updated_at, "owner": self._owner, "heartbeat": time.time()}
+
+    def _still_owned(self) -> bool:
+        slot = db.storage.json.get(self._slot_key, default={})
+        return slot.get("owner") == self._owner
+
+    def _claim_slot(self) -> bool:
+        # Prefer slots that were never used, then ones whose owner stopped heartbeating
+        slots = []
+        for slot_key in self._slot_keys():
+            slot = db.storage.json.get(slot_key, default={})
+            if not slot.get("owner") or time.time() - slot.get("heartbeat", 0) > self._lease_seconds:
+                slots.append((bool(slot), slot_key, slot))
+        for _, slot_key, slot in sorted(slots, key=lambda entry: entry[0]):
+            # The abandoned owner's counts carry over into this process's totals
+            totals = dict(slot.get("counts", {}))
+            db.storage.json.put(slot_key, self._slot_record(totals, slot.get("updated_at")))
+            time.sleep(CLAIM_SETTLE_SECONDS)
+            if db.storage.json.get(slot_key, default={}).get("owner") == self._owner:
+                with self._lock:
+                    self._slot_key, self._totals = slot_key, totals
+                return True
+        return False
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self._flush_interval)
+            self.flush()
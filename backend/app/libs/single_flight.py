@@ -0,0 +1,92 @@
+"""Single-flight coalescing for concurrent identical async calls.
+
+While a call for a key is in flight, later callers with the same key wait on
+it and share its result (or exception) instead of starting their own.
+
+Usage:
+
+    from app.libs.single_flight import get_single_flight
+
+    flights = get_single_flight("keyword_analysis")
+    result = await flights.do(cache_key, lambda: fetch_analysis(request))
+
+    # Several keys computed by one call; do() callers for any of them join it
+    results = await flights.do_many(cache_keys, lambda missing: fetch_analyses(missing))
+"""
+
+import asyncio
+import functools
+from typing import Awaitable, Callable, List, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Deduplicates concurrent async calls by key"""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run fn for key, or join the call already in flight for it"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._forget, key))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        # Shield so one caller disconnecting doesn't cancel the shared call
+        return await asyncio.shield(task)
+
+    async def do_many(self, keys: List[str], fn: Callable[[List[str]], Awaitable[List[T]]]) -> List[T]:
+        """
+        Like do() for several keys at once. Keys already in flight are joined, and the rest
+        are computed by a single fn(missing_keys) call that returns their results in order.
+        """
+        keys = list(dict.fromkeys(keys))
+        missing = [key for key in keys if key not in self._calls]
+        if missing:
+            batch = asyncio.create_task(fn(missing))
+            for index, key in enumerate(missing):
+                task = asyncio.create_task(self._batch_result(batch, index))
+                self._calls[key] = task
+                task.add_done_callback(functools.partial(self._forget, key))
+            self.started += len(missing)
+        self.coalesced += len(keys) - len(missing)
+
+        return list(await asyncio.shield(asyncio.gather(*[self._calls[key] for key in keys])))
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def is_in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+    @staticmethod
+    async def _batch_result(batch: asyncio.Task, index: int) -> T:
+        return (await asyncio.shield(batch))[index]
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieve the exception so it isn't reported as unhandled when every caller went away
+        if not task.cancelled():
+            task.exception()
+
+
+@functools.cache
+def get_single_flight(name: str) -> SingleFlight:
+    """Process-wide group by name, so separate APIs can coalesce on the same keys"""
+    return SingleFlight()
@@ -0,0 +1,102 @@
+"""Stripe SDK calls on a dedicated, bounded thread pool, with timeouts and metrics.
+
+The stripe SDK is synchronous, so async endpoints await call_stripe(), which
+runs the call on this module's executor instead of the event loop. Code that
+already runs in a thread uses call_stripe_sync(), which goes through the same
+executor, so the pool bounds every concurrent Stripe request in the process.
+Each call has an HTTP timeout and an overall deadline, including time spent
+waiting for a free thread, and its latency is recorded per API method.
+
+Usage:
+
+    from app.libs.stripe_client import call_stripe, call_stripe_sync
+
+    customer = await call_stripe(stripe.Customer.retrieve, "cus_123")
+    subscription = call_stripe_sync(stripe.Subscription.retrieve, "sub_123")
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable
+
+import stripe
+
+from app.libs.latency_histogram import get_latency_histogram
+
+# Stripe requests in flight per worker; further calls wait for a thread
+STRIPE_MAX_WORKERS = 16
+
+# Per HTTP request, enforced by the SDK's client
+STRIPE_HTTP_TIMEOUT = 20
+# Whole call, including the wait for a thread
+STRIPE_CALL_TIMEOUT = 30
+
+stripe.default_http_client = stripe.new_default_http_client(timeout=STRIPE_HTTP_TIMEOUT)
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=STRIPE_MAX_WORKERS, thread_name_prefix="stripe")
+_counts: dict[str, dict[str, int]] = {}
+_counts_lock = threading.Lock()
+
+
+def _call_name(fn: Callable) -> str:
+    # e.g. "customer.list" or "billing_portal.session.create"
+    owner = getattr(fn, "__self__", None)
+    resource = getattr(owner, "OBJECT_NAME", None) or getattr(owner, "__name__", None)
+    return f"{resource}.{fn.__name__}" if resource else fn.__name__
+
+
+def _count(name: str, field: str) -> None:
+    with _counts_lock:
+        counts = _counts.setdefault(name, {"calls": 0, "errors": 0, "timeouts": 0})
+        counts[field] += 1
+
+
+def _timed(name: str, fn: Callable, args: tuple, kwargs: dict) -> Any:
+    _count(name, "calls")
+    start = time.monotonic()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        _count(name, "errors")
+        raise
+    finally:
+        get_latency_histogram(f"stripe_{name}").record(time.monotonic() - start)
+
+
+def _timeout_error(name: str, timeout: float) -> stripe.error.APIConnectionError:
+    # The SDK reports its own network timeouts the same way, so callers treat both as transient
+    _count(name, "timeouts")
+    return stripe.error.APIConnectionError(f"Stripe {name} call timed out after {timeout}s")
+
+
+async def call_stripe(fn: Callable, *args: Any, timeout: float = STRIPE_CALL_TIMEOUT, **kwargs: Any) -> Any:
+    """Await fn(*args, **kwargs) on the Stripe executor; raises APIConnectionError after timeout seconds"""
+    name = _call_name(fn)
+    future = asyncio.get_running_loop().run_in_executor(_executor, _timed, name, fn, args, kwargs)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        raise _timeout_error(name, timeout) from None
+
+
+def call_stripe_sync(fn: Callable, *args: Any, timeout: float = STRIPE_CALL_TIMEOUT, **kwargs: Any) -> Any:
+    """Blocking variant of call_stripe for code already running off the event loop"""
+    name = _call_name(fn)
+    future = _executor.submit(_timed, name, fn, args, kwargs)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise _timeout_error(name, timeout) from None
+
+
+def stripe_call_stats() -> dict:
+    """Call, error and timeout counts with latency stats, per Stripe API method"""
+    with _counts_lock:
+        counts = {name: dict(values) for name, values in _counts.items()}
+    return {
+        name: {**values, "latency": get_latency_histogram(f"stripe_{name}").stats()}
+        for name, values in sorted(counts.items())
+    }
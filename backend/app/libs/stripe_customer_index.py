@@ -0,0 +1,164 @@
+"""Local index of Stripe customers: customer ID to app user ID and email, app
+user ID back to customer ID, and subscription ID to owning customer ID.
+
+Kept up to date from customer.* and subscription webhook events, from
+checkout and from whatever the webhook handlers learn along the way, so
+handlers can find a customer's email and user, and endpoints a user's
+customer or a subscription's owner, without calling Stripe or querying
+Firestore. Records live in an in-memory LRU in front of one db.storage.json
+key per customer, per user and per subscription.
+
+Usage:
+
+    from app.libs.stripe_customer_index import stripe_customer_index
+
+    stripe_customer_index.put("cus_123", user_id="firebase-uid", email="a@b.com")
+    record = stripe_customer_index.get("cus_123")  # {"customer_id", "user_id", "email", "updated_at"} or None
+    customer_id = stripe_customer_index.customer_for_user("firebase-uid")  # "cus_123" or None
+    stripe_customer_index.put_subscription("sub_123", "cus_123")
+    owner = stripe_customer_index.subscription_customer("sub_123")  # "cus_123" or None
+"""
+
+import re
+import threading
+from datetime import datetime
+from typing import Optional
+
+import databutton as db
+
+from app.libs.lru_cache import LRUCache
+
+KEY_PREFIX = "stripe_customer_"
+USER_KEY_PREFIX = "stripe_user_customer_"
+SUBSCRIPTION_KEY_PREFIX = "stripe_subscription_owner_"
+
+
+class StripeCustomerIndex:
+    """
+    customer_id -> {user_id, email}, user_id -> customer_id and subscription_id -> customer_id,
+    in memory with persistent backing
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self._cache = LRUCache(max_entries=max_entries, max_bytes=16 * 1024 * 1024, ttl_seconds=24 * 3600)
+        self._users = LRUCache(max_entries=max_entries, max_bytes=4 * 1024 * 1024, ttl_seconds=24 * 3600)
+        self._subscriptions = LRUCache(max_entries=max_entries, max_bytes=4 * 1024 * 1024, ttl_seconds=24 * 3600)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(customer_id: str) -> str:
+        return KEY_PREFIX + re.sub(r"[^A-Za-z0-9_.-]", "_", customer_id)
+
+    @staticmethod
+    def _user_key(user_id: str) -> str:
+        return USER_KEY_PREFIX + re.sub(r"[^A-Za-z0-9_.-]", "_", user_id)
+
+    @staticmethod
+    def _subscription_key(subscription_id: str) -> str:
+        return SUBSCRIPTION_KEY_PREFIX + re.sub(r"[^A-Za-z0-9_.-]", "_", subscription_id)
+
+    def get(self, customer_id: str) -> Optional[dict]:
+        record = self._cache.get(customer_id)
+        if record is not None:
+            return record or None
+        try:
+            record = db.storage.json.get(self._key(customer_id), default={})
+        except Exception as e:
+            print(f"Error reading customer index for {customer_id}: {e}")
+            return None
+        # Unknown customers are cached as {} so repeated misses don't hit storage
+        self._cache.set(customer_id, record)
+        return record or None
+
+    def customer_for_user(self, user_id: str) -> Optional[str]:
+        """The Stripe customer ID linked to an app user, or None if none is linked"""
+        customer_id = self._users.get(user_id)
+        if customer_id is not None:
+            return customer_id or None
+        try:
+            customer_id = db.storage.json.get(self._user_key(user_id), default={}).get("customer_id", "")
+        except Exception as e:
+            print(f"Error reading customer link for user {user_id}: {e}")
+            return None
+        # Users without a customer are cached as "" for the same reason as unknown customers
+        self._users.set(user_id, customer_id)
+        return customer_id or None
+
+    def subscription_customer(self, subscription_id: str) -> Optional[str]:
+        """The customer that owns a subscription, or None if it hasn't been indexed"""
+        customer_id = self._subscriptions.get(subscription_id)
+        if customer_id is not None:
+            return customer_id
+        try:
+            customer_id = db.storage.json.get(self._subscription_key(subscription_id), default={}).get("customer_id")
+        except Exception as e:
+            print(f"Error reading owner of subscription {subscription_id}: {e}")
+            return None
+        # Misses aren't cached: the subscription may be indexed by another instance at any time
+        if customer_id:
+            self._subscriptions.set(subscription_id, customer_id)
+        return customer_id
+
+    def put_subscription(self, subscription_id: str, customer_id: str) -> None:
+        """Record a subscription's owner; it never changes, so an indexed owner is never stale"""
+        if self.subscription_customer(subscription_id) == customer_id:
+            return
+        self._subscriptions.set(subscription_id, customer_id)
+        try:
+            db.storage.json.put(self._subscription_key(subscription_id), {"customer_id": customer_id})
+        except Exception as e:
+            print(f"Error writing owner of subscription {subscription_id}: {e}")
+
+    def put(self, customer_id: str, user_id: Optional[str] = None, email: Optional[str] = None) -> dict:
+        """
+        Merge the given fields into the customer's record; None leaves a field unchanged. A
+        user_id also links the user to this customer, replacing any earlier link.
+        """
+        if user_id:
+            self._link_user(user_id, customer_id)
+        with self._lock:
+            record = dict(self.get(customer_id) or {"customer_id": customer_id})
+            changed = False
+            for field, value in (("user_id", user_id), ("email", email)):
+                if value and record.get(field) != value:
+                    record[field] = value
+                    changed = True
+            if not changed:
+                return record
+
+            record["updated_at"] = datetime.now().isoformat()
+            self._cache.set(customer_id, record)
+        try:
+            db.storage.json.put(self._key(customer_id), record)
+        except Exception as e:
+            print(f"Error writing customer index for {customer_id}: {e}")
+        return record
+
+    def delete(self, customer_id: str) -> None:
+        user_id = (self.get(customer_id) or {}).get("user_id")
+        if user_id and self.customer_for_user(user_id) == customer_id:
+            self._users.set(user_id, "")
+            try:
+                db.storage.json.put(self._user_key(user_id), {})
+            except Exception as e:
+                print(f"Error clearing customer link for user {user_id}: {e}")
+        self._cache.set(customer_id, {})
+        try:
+            db.storage.json.put(self._key(customer_id), {})
+        except Exception as e:
+            print(f"Error clearing customer index for {customer_id}: {e}")
+
+    def stats(self) -> dict:
+        return {"customers": self._cache.stats(), "users": self._users.stats(), "subscriptions": self._subscriptions.stats()}
+
+    def _link_user(self, user_id: str, customer_id: str) -> None:
+        if self.customer_for_user(user_id) == customer_id:
+            return
+        self._users.set(user_id, customer_id)
+        try:
+            db.storage.json.put(self._user_key(user_id), {"customer_id": customer_id, "linked_at": datetime.now().isoformat()})
+        except Exception as e:
+            print(f"Error writing customer link for user {user_id}: {e}")
+
+
+stripe_customer_index = StripeCustomerIndex()
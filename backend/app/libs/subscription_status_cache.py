@@ -0,0 +1,150 @@
+"""Per-user cache of the Stripe subscription shown by /subscription/status.
+
+Entries are written by the status endpoint after a Stripe lookup and by the
+webhook handlers whenever a subscription event arrives for a known user, so
+in the common case the status is read without calling Stripe. Entries hold
+the subscription fields the endpoint needs, or None for users with no active
+subscription, and are persisted as one db.storage.json key per user so every
+instance sees webhook updates. An entry older than the TTL counts as missing
+and the endpoint falls back to Stripe, which covers missed webhooks.
+
+Usage:
+
+    from app.libs.subscription_status_cache import subscription_status_cache
+
+    entry = subscription_status_cache.get(user_id)  # {"subscription": dict | None, "cached_at", "as_of"} or None
+    if entry is None:
+        ...  # look up in Stripe
+        subscription_status_cache.put(user_id, subscription_record(subscription))
+"""
+
+import re
+import time
+from typing import Any, Optional
+
+import databutton as db
+
+from app.libs.lru_cache import LRUCache
+
+KEY_PREFIX = "subscription_status_"
+
+# Stored entries older than this are refreshed from Stripe
+STATUS_TTL_SECONDS = 15 * 60
+# Kept short so an update written by another instance is picked up quickly
+MEMORY_TTL_SECONDS = 30
+
+# The status endpoint lists only these subscriptions
+LISTED_STATUSES = ("active",)
+
+
+def payment_method_details(payment_method: Any) -> Optional[dict]:
+    """Card details of an expanded payment method; None if it isn't expanded or isn't a card"""
+    if not payment_method or isinstance(payment_method, str) or not getattr(payment_method, "card", None):
+        return None
+    return {
+        "brand": payment_method.card.brand,
+        "last4": payment_method.card.last4,
+        "exp_month": payment_method.card.exp_month,
+        "exp_year": payment_method.card.exp_year,
+        "id": payment_method.id,
+    }
+
+
+def subscription_record(subscription: Any, payment_method: Optional[dict] = None) -> dict:
+    """The fields of a Stripe subscription that the status endpoint returns"""
+    items = subscription.get("items")
+    price_id = items.data[0].price.id if items and items.data else None
+    return {
+        "subscription_id": subscription.id,
+        "status": subscription.status,
+        "plan_id": subscription.metadata.get("plan_id") if subscription.metadata else None,
+        "price_id": price_id,
+        "current_period_end": subscription.current_period_end,
+        "cancel_at_period_end": bool(subscription.cancel_at_period_end),
+        "trial_end": subscription.trial_end,
+        "payment_method": payment_method or payment_method_details(subscription.default_payment_method),
+    }
+
+
+class SubscriptionStatusCache:
+    """user_id -> listed subscription record (or None), in memory with persistent backing"""
+
+    def __init__(self, ttl_seconds: float = STATUS_TTL_SECONDS, max_entries: int = 10000):
+        self._ttl = ttl_seconds
+        self._cache = LRUCache(max_entries=max_entries, max_bytes=16 * 1024 * 1024, ttl_seconds=MEMORY_TTL_SECONDS)
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return KEY_PREFIX + re.sub(r"[^A-Za-z0-9_.-]", "_", user_id)
+
+    def get(self, user_id: str) -> Optional[dict]:
+        """The user's cached entry, or None if there is none or it has expired"""
+        entry = self._entry(user_id)
+        if "subscription" not in entry or time.time() - entry.get("cached_at", 0) > self._ttl:
+            return None
+        return entry
+
+    def put(self, user_id: str, record: Optional[dict], as_of: Optional[float] = None) -> None:
+        """
+        Cache the user's listed subscription, or None for no active subscription. as_of is when
+        the record was true in Stripe (an event's created time); it defaults to now.
+        """
+        now = time.time()
+        self._store(user_id, {"subscription": record, "cached_at": now, "as_of": as_of or now})
+
+    def invalidate(self, user_id: str, as_of: Optional[float] = None) -> None:
+        """Drop the user's entry so the next status read goes to Stripe"""
+        # Keeps as_of, so an older event can't repopulate the entry
+        self._store(user_id, {"as_of": as_of or time.time()})
+
+    def update_from_subscription(self, user_id: str, subscription: Any, as_of: Optional[float] = None) -> None:
+        """
+        Apply a subscription from a webhook event created at as_of. Falls back to invalidating
+        whenever the event alone can't say what the endpoint would list: the subscription isn't
+        listed (the user may have another one), or its payment method isn't expanded and isn't
+        already cached. Events older than the last update are ignored, since the webhook
+        workers may finish them out of order.
+        """
+        as_of = as_of or time.time()
+        entry = self._entry(user_id)
+        if entry.get("as_of", 0) > as_of:
+            return
+
+        if subscription.status not in LISTED_STATUSES:
+            self.invalidate(user_id, as_of)
+            return
+
+        payment_method = None
+        payment_method_id = subscription.default_payment_method
+        if isinstance(payment_method_id, str):
+            payment_method = (entry.get("subscription") or {}).get("payment_method")
+            if not payment_method or payment_method.get("id") != payment_method_id:
+                self.invalidate(user_id, as_of)
+                return
+
+        self.put(user_id, subscription_record(subscription, payment_method), as_of)
+
+    def _entry(self, user_id: str) -> dict:
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            return entry
+        try:
+            entry = db.storage.json.get(self._key(user_id), default={})
+        except Exception as e:
+            print(f"Error reading subscription status for {user_id}: {e}")
+            return {}
+        self._cache.set(user_id, entry)
+        return entry
+
+    def _store(self, user_id: str, entry: dict) -> None:
+        self._cache.set(user_id, entry)
+        try:
+            db.storage.json.put(self._key(user_id), entry)
+        except Exception as e:
+            print(f"Error writing subscription status for {user_id}: {e}")
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+subscription_status_cache = SubscriptionStatusCache()
@@ -0,0 +1,63 @@
+"""Shared fixtures: an in-memory stand-in for db.storage.
+
+Run from the backend directory with `python -m pytest tests`.
+"""
+
+import atexit
+import copy
+import re
+from dataclasses import dataclass
+
+import databutton as db
+import pytest
+
+_KEY_PATTERN = re.compile(r"^[a-zA-Z0-9-_.]+$")
+
+
+@dataclass
+class FileListEntry:
+    name: str
+    size: int
+
+
+class FakeBucket:
+    """One content type of db.storage (json or text), kept in a dict"""
+
+    def __init__(self):
+        self.files: dict = {}
+
+    def put(self, key: str, value) -> None:
+        if not _KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid key: {key}")
+        self.files[key] = copy.deepcopy(value)
+
+    def get(self, key: str, *, default=None):
+        if key in self.files:
+            return copy.deepcopy(self.files[key])
+        if default is None:
+            raise FileNotFoundError(key)
+        return default
+
+    def delete(self, key: str) -> None:
+        if key not in self.files:
+            raise FileNotFoundError(key)
+        del self.files[key]
+
+    def list(self) -> list[FileListEntry]:
+        return [FileListEntry(name=key, size=len(str(value))) for key, value in list(self.files.items())]
+
+
+class FakeStorage:
+    def __init__(self):
+        self.json = FakeBucket()
+        self.text = FakeBucket()
+        self.binary = FakeBucket()
+
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch) -> FakeStorage:
+    fake = FakeStorage()
+    monkeypatch.setattr(db, "storage", fake)
+    # Flushes registered at exit would run after the fake is gone, against real storage
+    monkeypatch.setattr(atexit, "register", lambda fn, *args, **kwargs: fn)
+    return fake
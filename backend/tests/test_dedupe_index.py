@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+import app.libs.dedupe_index as dedupe_index
+from app.libs.dedupe_index import DedupeIndex
+
+TTL_SECONDS = 3 * 24 * 3600
+
+
+@pytest.fixture(autouse=True)
+def no_background_flushes(monkeypatch):
+    monkeypatch.setattr(dedupe_index, "FLUSH_INTERVAL", 3600)
+    monkeypatch.setattr(dedupe_index, "SWEEP_INTERVAL", 3600)
+
+
+def make_index() -> DedupeIndex:
+    return DedupeIndex("events", ttl_seconds=TTL_SECONDS, claim_settle_seconds=0.01)
+
+
+def test_second_claim_is_a_duplicate():
+    index = make_index()
+
+    assert index.claim("evt_1")
+    assert not index.claim("evt_1")
+    assert index.stats()["duplicates"] == 1
+
+
+def test_claim_is_shared_between_instances():
+    assert make_index().claim("evt_1")
+    assert not make_index().claim("evt_1")
+
+
+def test_concurrent_claims_from_two_instances_let_one_through():
+    results = []
+    threads = [threading.Thread(target=lambda index=index: results.append(index.claim("evt_1"))) for index in (make_index(), make_index())]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False, True]
+
+
+def test_released_claim_can_be_claimed_again():
+    index = make_index()
+    index.claim("evt_1")
+    index.release("evt_1")
+
+    assert index.claim("evt_1")
+    assert not make_index().claim("evt_1")
+
+
+def test_done_state_is_visible_to_other_instances():
+    index = make_index()
+    index.claim("evt_1")
+    assert not index.is_done("evt_1")
+
+    index.mark_done("evt_1")
+    assert make_index().is_done("evt_1")
+
+
+def test_abandoned_claim_without_work_is_reclaimed(storage):
+    storage.json.put("events_evt_1", {"state": "claimed", "at": time.time() - 120, "owner": "dead"})
+    index = make_index()
+
+    assert index.claim("evt_1", has_work=lambda item_id: False)
+    assert index.stats()["reclaimed"] == 1
+
+
+def test_old_claim_with_work_is_honoured(storage):
+    storage.json.put("events_evt_1", {"state": "claimed", "at": time.time() - 120, "owner": "dead"})
+
+    assert not make_index().claim("evt_1", has_work=lambda item_id: True)
+
+
+def test_recent_claim_is_honoured_before_the_grace_period(storage):
+    storage.json.put("events_evt_1", {"state": "claimed", "at": time.time() - 5, "owner": "other"})
+
+    assert not make_index().claim("evt_1", has_work=lambda item_id: False)
+
+
+def test_entries_older_than_the_ttl_count_as_unseen(storage):
+    storage.json.put("events_evt_1", {"state": "done", "at": time.time() - TTL_SECONDS - 1, "owner": "other"})
+
+    assert make_index().claim("evt_1")
+
+
+def test_flush_writes_stored_ids_as_an_immutable_chunk(storage):
+    index = make_index()
+    index.claim("evt_1")
+    index.mark_done("evt_2")
+    index.flush()
+    index.claim("evt_3")
+    index.flush()
+    index.flush()
+
+    chunks = sorted(key for key in storage.json.files if key.startswith("events_expiry_"))
+    assert [storage.json.get(key)["ids"] for key in chunks] == [["evt_1", "evt_2"], ["evt_3"]]
+
+
+def test_sweep_deletes_expired_entries_and_their_chunks(storage):
+    index = make_index()
+    index.claim("evt_old")
+    index.claim("evt_seen_again")
+    index.flush()
+
+    # Age the chunk and one of its entries past the TTL
+    for key in [key for key in storage.json.files if key.startswith("events_expiry_")]:
+        flushed_at = key.split("_")[2]
+        storage.json.files[key.replace(flushed_at, "20000101000000")] = storage.json.files.pop(key)
+    storage.json.files["events_evt_old"]["at"] = time.time() - TTL_SECONDS - 1
+
+    index._delete_expired()
+
+    assert "events_evt_old" not in storage.json.files
+    assert "events_evt_seen_again" in storage.json.files
+    assert not [key for key in storage.json.files if key.startswith("events_expiry_")]
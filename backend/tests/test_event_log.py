@@ -0,0 +1,109 @@
+from datetime import timedelta
+
+import pytest
+
+from app.libs.event_log import SegmentedEventLog
+
+
+def make_log(**kwargs) -> SegmentedEventLog:
+    return SegmentedEventLog("events", flush_interval=3600, **kwargs)
+
+
+def test_reads_entries_newest_first_across_segments():
+    log = make_log(max_segment_entries=2)
+    for n in range(5):
+        log.append({"n": n})
+
+    events, cursor = log.read(limit=10)
+
+    assert [event["n"] for event in events] == [4, 3, 2, 1, 0]
+    assert cursor is None
+
+
+def test_pages_with_cursor():
+    log = make_log(max_segment_entries=3)
+    for n in range(7):
+        log.append({"n": n})
+    log.flush()
+
+    pages, cursor = [], None
+    while True:
+        events, cursor = log.read(cursor=cursor, limit=2)
+        pages.append([event["n"] for event in events])
+        if cursor is None:
+            break
+
+    assert pages == [[6, 5], [4, 3], [2, 1], [0]]
+
+
+def test_segments_from_other_instances_are_read():
+    first, second = make_log(), make_log()
+    first.append({"from": "first"})
+    first.flush()
+    second.append({"from": "second"})
+    second.flush()
+
+    events, _ = first.read()
+
+    assert [event["from"] for event in events] == ["second", "first"]
+
+
+def test_flushed_segments_are_not_rewritten(storage):
+    log = make_log()
+    log.append({"n": 1})
+    log.flush()
+    first_keys = set(storage.text.files)
+    log.append({"n": 2})
+    log.flush()
+
+    assert len(storage.text.files) == 2
+    assert first_keys < set(storage.text.files)
+
+
+def test_failed_flush_keeps_entries_buffered(storage, monkeypatch):
+    log = make_log()
+    log.append({"n": 1})
+
+    def fail(key, value):
+        raise ConnectionError("storage down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(storage.text, "put", fail)
+        log.flush()
+    assert storage.text.files == {}
+
+    events, _ = log.read()
+    assert [event["n"] for event in events] == [1]
+
+
+def test_malformed_cursor_raises_value_error():
+    log = make_log()
+
+    with pytest.raises(ValueError):
+        log.read(cursor="no-position-separator")
+    with pytest.raises(ValueError):
+        log.read(cursor="events_1:abc")
+
+
+def test_expired_segments_are_deleted(storage):
+    log = make_log(retention=timedelta(days=1))
+    log.append({"n": "new"})
+    log.flush()
+    storage.text.put("events_20000101000000000000_abcdef12_1", '{"n": "old"}\n')
+
+    log._delete_expired()
+
+    events, _ = log.read()
+    assert [event["n"] for event in events] == ["new"]
+
+
+def test_segments_beyond_max_segments_are_deleted(storage):
+    log = make_log(max_segment_entries=1, max_segments=2)
+    for n in range(4):
+        log.append({"n": n})
+    log.flush()
+
+    log._delete_expired()
+
+    events, _ = log.read()
+    assert [event["n"] for event in events] == [3, 2]
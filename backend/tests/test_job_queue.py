@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+import pytest
+
+import app.libs.job_queue as job_queue
+from app.libs.job_queue import JOB_COMPLETED, JOB_FAILED, JobQueue
+
+LEASE_SECONDS = 0.3
+
+
+@pytest.fixture(autouse=True)
+def fast_leases(monkeypatch):
+    monkeypatch.setattr(job_queue, "CLAIM_SETTLE_SECONDS", 0)
+    monkeypatch.setattr(job_queue, "SWEEP_LEASES", 1)
+
+
+async def wait_for(queue: JobQueue, job_id: str, status: str, timeout: float = 3.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = await queue.get(job_id)
+        if job and job["status"] == status:
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+
+def stored_job(job_id: str, status: str = "running") -> dict:
+    return {
+        "id": job_id, "status": status, "payload": {"n": job_id}, "result": None, "error": None,
+        "attempts": 1, "owner": None, "expires_at": None, "created_at": "", "updated_at": "",
+    }
+
+
+def test_runs_job_and_stores_result(storage):
+    async def handle(payload):
+        return {"doubled": payload["n"] * 2}
+
+    async def main():
+        queue = JobQueue("jobs", handle, lease_seconds=LEASE_SECONDS)
+        job = await queue.submit({"n": 21}, owner="user_1")
+        return await wait_for(queue, job["id"], JOB_COMPLETED)
+
+    job = asyncio.run(main())
+    assert job["result"] == {"doubled": 42}
+    assert job["owner"] == "user_1"
+    assert not [key for key in storage.json.files if "_lease_" in key]
+
+
+def test_failed_attempt_is_retried_after_backoff():
+    attempts = []
+
+    async def handle(payload):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RuntimeError("transient")
+        return {"ok": True}
+
+    async def main():
+        queue = JobQueue("jobs", handle, max_attempts=3, retry_delay_seconds=0.1, lease_seconds=LEASE_SECONDS)
+        job = await queue.submit({})
+        return await wait_for(queue, job["id"], JOB_COMPLETED)
+
+    job = asyncio.run(main())
+    assert job["attempts"] == 2
+    assert job["error"] is None
+    assert attempts[1] - attempts[0] >= 0.1
+
+
+def test_job_failing_every_attempt_is_dead_lettered_and_can_be_retried():
+    fail = True
+
+    async def handle(payload):
+        if fail:
+            raise RuntimeError("permanent")
+        return {"ok": True}
+
+    async def main():
+        nonlocal fail
+        queue = JobQueue("jobs", handle, max_attempts=2, retry_delay_seconds=0.01, dead_letter=True, lease_seconds=LEASE_SECONDS)
+        job = await queue.submit({})
+        failed = await wait_for(queue, job["id"], JOB_FAILED)
+        dead = await queue.dead_letters()
+
+        fail = False
+        assert await queue.retry(job["id"]) is not None
+        completed = await wait_for(queue, job["id"], JOB_COMPLETED)
+        return failed, dead, completed, await queue.dead_letters()
+
+    failed, dead, completed, dead_after_retry = asyncio.run(main())
+    assert (failed["attempts"], failed["error"]) == (2, "permanent")
+    assert [job["id"] for job in dead] == [failed["id"]]
+    assert completed["result"] == {"ok": True}
+    assert dead_after_retry == []
+
+
+def test_job_with_lapsed_lease_is_taken_over(storage):
+    ran = []
+
+    async def handle(payload):
+        ran.append(payload["n"])
+        return {}
+
+    storage.json.put("jobs_job_abandoned", stored_job("abandoned"))
+    storage.json.put("jobqueue_jobs_lease_abandoned", {"owner": "dead_instance", "lease_until": time.time() - 1})
+
+    async def main():
+        queue = JobQueue("jobs", handle, lease_seconds=LEASE_SECONDS)
+        await queue.get("abandoned")  # starts the workers and the sweep
+        return await wait_for(queue, "abandoned", JOB_COMPLETED)
+
+    job = asyncio.run(main())
+    assert ran == ["abandoned"]
+    assert job["attempts"] == 2
+
+
+def test_job_with_live_lease_is_left_to_its_holder(storage):
+    ran = []
+
+    async def handle(payload):
+        ran.append(payload["n"])
+        return {}
+
+    storage.json.put("jobs_job_held", stored_job("held"))
+    storage.json.put("jobqueue_jobs_lease_held", {"owner": "live_instance", "lease_until": time.time() + 60})
+
+    async def main():
+        queue = JobQueue("jobs", handle, lease_seconds=LEASE_SECONDS)
+        await queue.get("held")
+        await asyncio.sleep(LEASE_SECONDS * 3)
+
+    asyncio.run(main())
+    assert ran == []
+    assert storage.json.get("jobqueue_jobs_lease_held")["owner"] == "live_instance"
+
+
+def test_running_job_keeps_its_lease_across_instances():
+    ran = []
+
+    async def handle(payload):
+        ran.append(payload["n"])
+        await asyncio.sleep(LEASE_SECONDS * 4)
+        return {}
+
+    async def main():
+        first = JobQueue("jobs", handle, lease_seconds=LEASE_SECONDS)
+        second = JobQueue("jobs", handle, lease_seconds=LEASE_SECONDS)
+        job = await first.submit({"n": 1})
+        await second.get(job["id"])  # starts the second instance's sweep
+        return await wait_for(first, job["id"], JOB_COMPLETED)
+
+    asyncio.run(main())
+    assert ran == [1]
+
+
+def test_finished_jobs_are_deleted_after_their_ttl(storage, monkeypatch):
+    monkeypatch.setattr(job_queue, "CLEANUP_INTERVAL", 0)
+
+    async def handle(payload):
+        return {}
+
+    async def main():
+        queue = JobQueue("jobs", handle, lease_seconds=LEASE_SECONDS, finished_ttl_seconds=0.2)
+        job = await queue.submit({})
+        await wait_for(queue, job["id"], JOB_COMPLETED)
+        await asyncio.sleep(2.0)
+        return job["id"], await queue.get(job["id"])
+
+    job_id, job = asyncio.run(main())
+    assert job is None
+    assert f"jobs_job_{job_id}" not in storage.json.files
+    assert not [key for key in storage.json.files if key.startswith("jobqueue_jobs_expiry_")]
@@ -0,0 +1,46 @@
+from app.libs.keyword_metrics_store import KeywordMetricsStore
+
+
+def test_returns_stored_metrics_and_missing_keywords():
+    store = KeywordMetricsStore()
+    store.put_many(["Budget Template"], [{"keyword": "budget template", "search_volume": 900}], 2840, "en")
+
+    found, missing = store.get_many(["budget template", "savings calculator"], 2840, "en")
+
+    assert found == {"budget template": {"keyword": "budget template", "search_volume": 900}}
+    assert missing == ["savings calculator"]
+
+
+def test_keywords_are_matched_case_insensitively():
+    store = KeywordMetricsStore()
+    store.put_many(["budget template"], [{"keyword": "Budget Template", "search_volume": 900}], 2840, "en")
+
+    found, missing = store.get_many(["BUDGET TEMPLATE"], 2840, "en")
+
+    assert list(found) == ["budget template"]
+    assert missing == []
+
+
+def test_requested_keywords_without_data_are_remembered_as_zero_volume():
+    store = KeywordMetricsStore()
+    store.put_many(["obscure keyword"], [], 2840, "en")
+
+    found, missing = store.get_many(["obscure keyword"], 2840, "en")
+
+    assert found == {"obscure keyword": {"keyword": "obscure keyword", "search_volume": 0}}
+    assert missing == []
+
+
+def test_locations_and_languages_are_stored_separately():
+    store = KeywordMetricsStore()
+    store.put_many(["budget"], [{"keyword": "budget", "search_volume": 900}], 2840, "en")
+
+    assert store.get_many(["budget"], 2826, "en")[1] == ["budget"]
+    assert store.get_many(["budget"], 2840, "es")[1] == ["budget"]
+
+
+def test_entries_expire_with_the_ttl():
+    store = KeywordMetricsStore(ttl_seconds=0)
+    store.put_many(["budget"], [{"keyword": "budget", "search_volume": 900}], 2840, "en")
+
+    assert store.get_many(["budget"], 2840, "en") == ({}, ["budget"])
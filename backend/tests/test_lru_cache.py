@@ -0,0 +1,72 @@
+import time
+
+from app.libs.lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used_entry():
+    cache = LRUCache(max_entries=2, max_bytes=1024, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_evicts_to_stay_within_max_bytes():
+    cache = LRUCache(max_entries=10, max_bytes=10, ttl_seconds=60)
+    cache.set("a", "x" * 6)
+    cache.set("b", "y" * 6)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 6
+    assert cache.stats()["bytes"] == 6
+
+
+def test_skips_values_larger_than_max_bytes():
+    cache = LRUCache(max_entries=10, max_bytes=4, ttl_seconds=60)
+    cache.set("a", "too large")
+
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_entries_expire_after_ttl():
+    cache = LRUCache(max_entries=10, max_bytes=1024, ttl_seconds=60)
+    cache.set("short", 1, ttl_seconds=0.01)
+    cache.set("long", 2)
+    time.sleep(0.02)
+
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+    assert cache.stats()["expirations"] == 1
+
+
+def test_zero_ttl_is_not_stored():
+    cache = LRUCache(max_entries=10, max_bytes=1024, ttl_seconds=60)
+    cache.set("a", 1, ttl_seconds=0)
+
+    assert cache.get("a") is None
+
+
+def test_replacing_an_entry_updates_size():
+    cache = LRUCache(max_entries=10, max_bytes=1024, ttl_seconds=60)
+    cache.set("a", "x" * 10)
+    cache.set("a", "x" * 3)
+
+    assert cache.stats()["bytes"] == 3
+    cache.delete("a")
+    assert cache.stats()["bytes"] == 0
+
+
+def test_stats_count_hits_and_misses():
+    cache = LRUCache(max_entries=10, max_bytes=1024, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("missing")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
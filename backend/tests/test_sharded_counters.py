@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+import app.libs.sharded_counters as sharded_counters
+from app.libs.sharded_counters import ShardedCounters
+
+
+@pytest.fixture(autouse=True)
+def fast_claims(monkeypatch):
+    monkeypatch.setattr(sharded_counters, "CLAIM_SETTLE_SECONDS", 0)
+
+
+def make_counters(**kwargs) -> ShardedCounters:
+    return ShardedCounters("metrics", flush_interval=3600, slots=4, read_cache_seconds=0, **kwargs)
+
+
+def test_reads_include_unflushed_increments():
+    counters = make_counters()
+    counters.add({"active": 2, "trial": 1})
+    counters.add({"active": -1, "trial": 0})
+
+    counts = counters.read()
+    assert (counts["active"], counts["trial"]) == (1, 1)
+    assert counts["last_updated"] is not None
+
+
+def test_each_process_flushes_to_its_own_slot(storage):
+    first, second = make_counters(), make_counters()
+    first.add({"active": 1})
+    second.add({"active": 2})
+    first.flush()
+    second.flush()
+
+    slots = {key: storage.json.get(key)["counts"] for key in storage.json.files}
+    assert sorted(slots.values(), key=lambda counts: counts["active"]) == [{"active": 1}, {"active": 2}]
+    assert make_counters().read()["active"] == 3
+
+
+def test_flushes_accumulate_in_the_held_slot(storage):
+    counters = make_counters()
+    counters.add({"active": 1})
+    counters.flush()
+    counters.add({"active": 1})
+    counters.flush()
+
+    assert [storage.json.get(key)["counts"] for key in storage.json.files] == [{"active": 2}]
+
+
+def test_slot_without_heartbeat_is_taken_over_with_its_counts(storage):
+    storage.json.put("metrics_shard_0", {"counts": {"active": 5}, "updated_at": None, "owner": "dead", "heartbeat": time.time() - 600})
+    for index in range(1, 4):
+        storage.json.put(f"metrics_shard_{index}", {"counts": {}, "updated_at": None, "owner": f"live_{index}", "heartbeat": time.time()})
+
+    counters = make_counters(lease_seconds=300)
+    counters.add({"active": 1})
+    counters.flush()
+
+    slot = storage.json.get("metrics_shard_0")
+    assert slot["owner"] == counters._owner
+    assert slot["counts"] == {"active": 6}
+    assert counters.read()["active"] == 6
+
+
+def test_live_slots_are_not_taken_over(storage):
+    for index in range(4):
+        storage.json.put(f"metrics_shard_{index}", {"counts": {}, "updated_at": None, "owner": f"live_{index}", "heartbeat": time.time()})
+
+    counters = make_counters(lease_seconds=300)
+    counters.add({"active": 1})
+    counters.flush()
+
+    # No free slot: the increment stays buffered for the next flush
+    assert all(storage.json.get(f"metrics_shard_{index}")["owner"] == f"live_{index}" for index in range(4))
+    assert counters.read()["active"] == 1
+
+
+def test_lost_slot_is_given_up_and_pending_increments_move_to_a_new_one(storage):
+    counters = make_counters()
+    counters.add({"active": 1})
+    counters.flush()
+    lost_slot = counters._slot_key
+    storage.json.put(lost_slot, {"counts": {"active": 1}, "updated_at": None, "owner": "other", "heartbeat": time.time()})
+
+    counters.add({"active": 1})
+    counters.flush()
+
+    assert counters._slot_key != lost_slot
+    assert storage.json.get(counters._slot_key)["counts"] == {"active": 1}
+    assert make_counters().read()["active"] == 2
+
+
+def test_stored_counts_are_cached_between_reads(storage):
+    counters = ShardedCounters("metrics", flush_interval=3600, slots=4, read_cache_seconds=60)
+    assert counters.read().get("active") is None
+
+    other = make_counters()
+    other.add({"active": 1})
+    other.flush()
+
+    assert counters.read().get("active") is None
+    counters._stored = None
+    assert counters.read()["active"] == 1
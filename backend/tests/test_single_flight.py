@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from app.libs.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*[flights.do("key", fetch) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert calls == 1
+    assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 4}
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+
+    async def main():
+        return await asyncio.gather(flights.do("a", _value("a")), flights.do("b", _value("b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert flights.started == 2
+
+
+def test_error_reaches_every_caller_and_key_is_forgotten():
+    flights = SingleFlight()
+    calls = 0
+
+    async def fail():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def main():
+        results = await asyncio.gather(*[flights.do("key", fail) for _ in range(3)], return_exceptions=True)
+        # A later call starts over instead of reusing the failure
+        retry = await flights.do("key", _value("recovered"))
+        return results, retry
+
+    results, retry = asyncio.run(main())
+    assert calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retry == "recovered"
+    assert not flights.is_in_flight("key")
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    flights = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        first = asyncio.create_task(flights.do("key", slow))
+        second = asyncio.create_task(flights.do("key", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_do_many_joins_keys_in_flight_and_batches_the_rest():
+    flights = SingleFlight()
+    batches = []
+
+    async def single():
+        await asyncio.sleep(0.01)
+        return "a from do"
+
+    async def batch(keys):
+        batches.append(keys)
+        return [f"{key} from batch" for key in keys]
+
+    async def main():
+        joined = asyncio.create_task(flights.do("a", single))
+        await asyncio.sleep(0)
+        results = await flights.do_many(["a", "b", "c", "b"], batch)
+        await joined
+        return results
+
+    assert asyncio.run(main()) == ["a from do", "b from batch", "c from batch"]
+    assert batches == [["b", "c"]]
+
+
+def test_do_many_error_reaches_joined_callers():
+    flights = SingleFlight()
+
+    async def batch(keys):
+        await asyncio.sleep(0.01)
+        raise ValueError("batch failed")
+
+    async def main():
+        many = asyncio.create_task(flights.do_many(["a", "b"], batch))
+        await asyncio.sleep(0)
+        with pytest.raises(ValueError):
+            await flights.do("b", _value("unused"))
+        with pytest.raises(ValueError):
+            await many
+
+    asyncio.run(main())
+    assert flights.in_flight() == 0
+
+
+def _value(value):
+    async def fn():
+        return value
+    return fn
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import pytest
+import stripe
+
+from app.libs import stripe_client
+from app.libs.stripe_client import call_stripe, call_stripe_sync, stripe_call_stats
+
+
+class FakeResource:
+    OBJECT_NAME = "test_resource"
+
+    @classmethod
+    def retrieve(cls, resource_id, delay=0.0):
+        time.sleep(delay)
+        if resource_id == "missing":
+            raise stripe.error.InvalidRequestError("No such resource", "id")
+        return {"id": resource_id}
+
+
+@pytest.fixture(autouse=True)
+def reset_counts(monkeypatch):
+    monkeypatch.setattr(stripe_client, "_counts", {})
+
+
+def test_call_stripe_runs_the_call_and_counts_it():
+    result = asyncio.run(call_stripe(FakeResource.retrieve, "res_1"))
+
+    assert result == {"id": "res_1"}
+    stats = stripe_call_stats()["test_resource.retrieve"]
+    assert (stats["calls"], stats["errors"], stats["timeouts"]) == (1, 0, 0)
+
+
+def test_call_stripe_passes_errors_through_and_counts_them():
+    with pytest.raises(stripe.error.InvalidRequestError):
+        asyncio.run(call_stripe(FakeResource.retrieve, "missing"))
+
+    assert stripe_call_stats()["test_resource.retrieve"]["errors"] == 1
+
+
+def test_call_stripe_times_out_as_a_connection_error():
+    with pytest.raises(stripe.error.APIConnectionError):
+        asyncio.run(call_stripe(FakeResource.retrieve, "res_1", delay=0.2, timeout=0.05))
+
+    assert stripe_call_stats()["test_resource.retrieve"]["timeouts"] == 1
+
+
+def test_call_stripe_sync_uses_the_same_executor_and_counts():
+    assert call_stripe_sync(FakeResource.retrieve, "res_1") == {"id": "res_1"}
+
+    with pytest.raises(stripe.error.APIConnectionError):
+        call_stripe_sync(FakeResource.retrieve, "res_1", delay=0.2, timeout=0.05)
+
+    stats = stripe_call_stats()["test_resource.retrieve"]
+    assert (stats["calls"], stats["timeouts"]) == (2, 1)